@@ -1,18 +1,42 @@
 import os
 
-from flask import Flask, redirect, request, session
-from flask.json import jsonify
+from flask import Flask, abort, redirect, request, session
 from flask_cors import CORS
 from flask_session import Session
 from requests_oauthlib.oauth2_session import OAuth2Session
 
-from api_server.database import db
+from api_server.async_destiny_api import AsyncDestinyAPI
+from api_server.character_cache import character_cache
+from api_server.cli import manifest_cli
+from api_server.database import db, init_database
 from api_server.destiny_api import DestinyAPI
-from api_server.models import CharacterSchema, FullCharacterDataSchema, User, UserSchema
+from api_server.destiny_manifest import manifest_cache
+from api_server.json_response import init_json, json_page_response, json_response
+from api_server.manifest_warmup import init_manifest_warmup
+from api_server.loadout_optimizer import (
+    LOADOUT_MAX_TIME_BUDGET,
+    LOADOUT_TIME_BUDGET,
+    optimize_loadout,
+)
+from api_server.mod_fit import ArmorColumns, Mod
+from api_server.models import ArmorStat, ArmorType, LoadoutSchema, User, UserSchema
+from api_server.profile_cache import profile_cache
 from api_server.repositories.user_repository import UserRepository
+from api_server.serializers import (
+    dump_armor_piece,
+    dump_character,
+    dump_full_character_data,
+)
+from api_server.user_cache import user_cache
 
 # from werkzeug.middleware.profiler import ProfilerMiddleware
 
+# armor pieces per /inventory page
+INVENTORY_PAGE_SIZE = 100
+INVENTORY_MAX_PAGE_SIZE = 500
+# mod sets per /inventory/mod-fit request
+MOD_FIT_MAX_MOD_SETS = 1000
+
 
 sess = Session()
 
@@ -34,6 +58,11 @@ def create_app():
     )
     app.config["SESSION_TYPE"] = "redis"
     sess.init_app(app)
+    init_json(app)
+    init_database(app)
+    app.cli.add_command(manifest_cli)
+    # loads the manifest tables before the app is returned to the server, see gunicorn.conf.py
+    manifest_warmup = init_manifest_warmup(app)
 
     @app.route("/login")
     def login():
@@ -66,13 +95,12 @@ def create_app():
         session["destinyMembershipType"] = user.destiny_membership_type
         session["destinyMembershipID"] = user.destiny_membership_id
 
-        user_repository = UserRepository()
-        existing_user = user_repository.get_user(
-            user.destiny_membership_type, user.destiny_membership_id
-        )
+        # a new login usually follows changes made in game
+        destiny_api.invalidate_profile()
 
-        if existing_user is None:
-            user_repository.create_user(user)
+        # one statement whether or not the user exists, it also picks up display name changes
+        user_repository = UserRepository()
+        user_repository.upsert_user(user)
 
         return redirect(os.environ.get("APP_URL"))
 
@@ -85,22 +113,141 @@ def create_app():
 
         user = user_repository.get_user(membership_type, membership_id)
 
-        res = jsonify(UserSchema().dump(user))
+        res = json_response(UserSchema().dump(user))
 
         return res
 
+    @app.route("/profile/refresh", methods=["POST"])
+    def refresh_profile():
+        # the frontend calls this after anything that changes the user's loadout
+        destiny_api = DestinyAPI()
+        destiny_api.invalidate_profile()
+
+        return "", 204
+
+    @app.route("/ready")
+    def get_ready():
+        # readiness probe, the worker only takes traffic once the manifest warmup is done
+        manifest_warmup.check()
+        status = 200 if manifest_warmup.ready else 503
+
+        return json_response(manifest_warmup.stats(), status=status)
+
+    @app.route("/metrics")
+    def get_metrics():
+        return json_response(
+            {
+                "manifestCache": manifest_cache.stats(),
+                "profileCache": profile_cache.stats(),
+                "characterCache": character_cache.stats(),
+                "manifestWarmup": manifest_warmup.stats(),
+                "userCache": user_cache.stats(),
+                "database": db.stats(),
+            }
+        )
+
     @app.route("/characters")
     def get_characters():
         destiny_api = DestinyAPI()
 
-        return jsonify(CharacterSchema().dump(destiny_api.get_characters(), many=True))
+        return json_response([dump_character(c) for c in destiny_api.get_characters()])
+
+    @app.route("/characters/full")
+    def get_full_characters():
+        destiny_api = DestinyAPI()
+
+        return json_response(destiny_api.get_full_characters_data())
 
     @app.route("/characters/<character_id>")
     def get_character(character_id):
         destiny_api = DestinyAPI()
 
-        return jsonify(
-            FullCharacterDataSchema().dump(destiny_api.get_character(character_id))
+        return json_response(destiny_api.get_character_data(character_id))
+
+    @app.route("/inventory")
+    def get_inventory():
+        # every armor piece the user has, a page at a time. Pages are streamed as the pieces are built,
+        # nextCursor is passed back as cursor to get the next one
+        cursor = request.args.get("cursor", 0, type=int)
+        limit = request.args.get("limit", INVENTORY_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, INVENTORY_MAX_PAGE_SIZE))
+
+        destiny_api = DestinyAPI()
+        armor = destiny_api.get_inventory_armor(max(0, cursor))
+
+        return json_page_response(
+            ((position, dump_armor_piece(a)) for position, a in armor), limit
         )
 
+    @app.route("/inventory/mod-fit", methods=["POST"])
+    def get_inventory_mod_fit():
+        # the body is {"modSets": [[{"socketType", "energyType", "energyCost"}, ...], ...], "replaceMods": bool},
+        # the response has the instance ids of the armor pieces each mod set fits, in inventory order
+        body = request.get_json(silent=True) or {}
+        try:
+            mod_sets = [[Mod.from_json(m) for m in mods] for mods in body["modSets"]]
+        except (KeyError, TypeError, ValueError):
+            abort(400, "modSets must be a list of lists of mods")
+        if len(mod_sets) > MOD_FIT_MAX_MOD_SETS:
+            abort(
+                400, f"at most {MOD_FIT_MAX_MOD_SETS} mod sets can be checked at once"
+            )
+
+        destiny_api = DestinyAPI()
+        armor = ArmorColumns([a for _, a in destiny_api.get_inventory_armor()])
+        fits = armor.fitting_item_instance_ids(
+            mod_sets, replace=body.get("replaceMods", True)
+        )
+
+        return json_response({"fits": fits})
+
+    @app.route("/loadouts/optimize", methods=["POST"])
+    def optimize_loadouts():
+        # the body is {"classType", "stats": [stat hash, ...], "minimums": {stat hash: value},
+        # "mods": {armor type: [mod, ...]}, "timeBudget": seconds}, stats defaults to every armor stat.
+        # The response is the best loadout found, or null when no loadout has the mods and minimums
+        body = request.get_json(silent=True) or {}
+        try:
+            class_type = int(body["classType"])
+            stat_hashes = [
+                int(ArmorStat(int(h))) for h in body.get("stats", list(ArmorStat))
+            ]
+            minimums = {
+                int(ArmorStat(int(h))): int(v)
+                for h, v in body.get("minimums", {}).items()
+            }
+            mods = {
+                ArmorType(int(t)): [Mod.from_json(m) for m in slot_mods]
+                for t, slot_mods in body.get("mods", {}).items()
+            }
+            time_budget = float(body.get("timeBudget", LOADOUT_TIME_BUDGET))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            abort(400, "invalid loadout request")
+
+        destiny_api = DestinyAPI()
+        loadout = optimize_loadout(
+            destiny_api.get_loadout_candidates(class_type),
+            stat_hashes,
+            minimums,
+            mods,
+            time_budget=max(0, min(time_budget, LOADOUT_MAX_TIME_BUDGET)),
+        )
+
+        return json_response(LoadoutSchema().dump(loadout) if loadout else None)
+
+    # the same endpoints served through AsyncDestinyAPI, to compare against the sync ones
+    @app.route("/async/characters")
+    async def get_characters_async():
+        async with AsyncDestinyAPI() as destiny_api:
+            characters = await destiny_api.get_characters()
+
+        return json_response([dump_character(c) for c in characters])
+
+    @app.route("/async/characters/<character_id>")
+    async def get_character_async(character_id):
+        async with AsyncDestinyAPI() as destiny_api:
+            character = await destiny_api.get_character(character_id)
+
+        return json_response(dump_full_character_data(character))
+
     return app
@@ -0,0 +1,95 @@
+import asyncio
+
+from flask import session
+
+from api_server.definition_resolver import DefinitionResolver
+from api_server.destiny_api import (
+    CharacterResponse,
+    build_characters,
+    build_full_character,
+    character_url,
+    characters_url,
+    linked_profiles_url,
+    load_race_and_class,
+    prefetch_equipment,
+)
+from api_server.destiny_manifest import AsyncDestinyManifest
+from api_server.http_client import AsyncBungieClient, refresh_token, token_expired
+from api_server.models import User
+
+
+# Same models as DestinyAPI, but Bungie calls are awaited and manifest lookups run on worker threads, so the
+# profile is fetched while the manifest version is read and independent definition tables load concurrently.
+# Use it as an async context manager, its client is closed on exit.
+class AsyncDestinyAPI:
+    def __init__(self):
+        self.client = None
+
+    async def __aenter__(self):
+        self.client = await self.get_client()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    async def get_client(self):
+        token = session.get("oauth_token")
+
+        if token is not None and token_expired(token):
+            token = await asyncio.to_thread(refresh_token, token)
+            session["oauth_token"] = token
+
+        return AsyncBungieClient(token)
+
+    async def get_json(self, url):
+        res = await self.client.get(url)
+        return res.json()
+
+    async def get_bungie_user_linked_profiles(self):
+        token = session.get("oauth_token")
+        res = await self.get_json(linked_profiles_url(token))
+
+        return User.from_json(res)
+
+    async def get_characters(self):
+
+        membership_type = session.get("destinyMembershipType")
+        membership_id = session.get("destinyMembershipID")
+
+        manifest = AsyncDestinyManifest()
+        res, _ = await asyncio.gather(
+            self.get_json(characters_url(membership_type, membership_id)),
+            manifest.get_version(),
+        )
+
+        characters_res = list(res["Response"]["characters"]["data"].values())
+
+        resolver = DefinitionResolver(manifest.manifest.get_definitions)
+        await asyncio.to_thread(load_race_and_class, resolver, characters_res)
+
+        return build_characters(characters_res, resolver)
+
+    async def get_character(self, character_id):
+
+        membership_type = session.get("destinyMembershipType")
+        membership_id = session.get("destinyMembershipID")
+
+        manifest = AsyncDestinyManifest()
+        res, _ = await asyncio.gather(
+            self.get_json(character_url(membership_type, membership_id, character_id)),
+            manifest.get_version(),
+        )
+
+        character_response = CharacterResponse.from_json(res)
+
+        # race and class don't depend on the equipment, so they're loaded next to it.
+        # the resolver is only shared between threads that fill different tables
+        resolver = DefinitionResolver(manifest.manifest.get_definitions)
+        await asyncio.gather(
+            asyncio.to_thread(
+                load_race_and_class, resolver, [character_response.character]
+            ),
+            asyncio.to_thread(prefetch_equipment, resolver, [character_response]),
+        )
+
+        return build_full_character(character_response, resolver)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import threading
+
+from api_server.redis_client import get_redis
+
+# how long a built character is kept, entries are never stale since the fingerprint covers everything they're built from
+CHARACTER_CACHE_TTL = int(os.environ.get("CHARACTER_CACHE_TTL", 24 * 60 * 60))
+# part of every fingerprint, bump it when the models or schemas change what a character dumps to
+CHARACTER_CACHE_FORMAT = 1
+
+
+def character_fingerprint(manifest_version, character_response):
+    # the dumped FullCharacterData only depends on the manifest and the parts of the profile response
+    # CharacterResponse keeps for this character, so those are hashed instead of comparing the output
+    items = character_response.armor + [character_response.subclass]
+    instance_ids = [i["itemInstanceId"] for i in items]
+
+    fingerprint = hashlib.sha1(
+        json.dumps(
+            [
+                CHARACTER_CACHE_FORMAT,
+                manifest_version,
+                character_response.character,
+                items,
+                [character_response.instances.get(i) for i in instance_ids],
+                [character_response.sockets.get(i) for i in instance_ids],
+                character_response.talent_grid,
+            ],
+            sort_keys=True,
+        ).encode()
+    )
+    return fingerprint.hexdigest()
+
+
+# Dumped FullCharacterDataSchema output in redis keyed by character_fingerprint, so a character whose
+# equipment hasn't changed skips building the models and dumping them
+class CharacterCache:
+    def __init__(self, ttl=CHARACTER_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def redis(self):
+        return get_redis()
+
+    def get_many(self, fingerprints):
+        # returns a list with the cached dump, or None, for each fingerprint
+        if self.ttl <= 0 or not fingerprints:
+            return [None] * len(fingerprints)
+
+        values = self.redis.mget([f"character:{f}" for f in fingerprints])
+        found = [json.loads(v) if v is not None else None for v in values]
+
+        with self.lock:
+            hits = sum(1 for v in found if v is not None)
+            self.hits += hits
+            self.misses += len(found) - hits
+
+        return found
+
+    def set_many(self, dumped_characters):
+        # dumped_characters is a dict of fingerprint -> dumped character
+        if self.ttl <= 0 or not dumped_characters:
+            return
+
+        pipeline = self.redis.pipeline(transaction=False)
+        for fingerprint, dumped in dumped_characters.items():
+            pipeline.set(f"character:{fingerprint}", json.dumps(dumped), ex=self.ttl)
+        pipeline.execute()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0,
+            }
+
+
+character_cache = CharacterCache()
@@ -0,0 +1,39 @@
+import json
+
+import click
+from flask.cli import AppGroup
+
+from api_server.destiny_manifest import DestinyManifest
+from api_server.manifest_warmup import ManifestWarmup
+
+manifest_cli = AppGroup("manifest", help="Manage the stored Destiny manifest.")
+
+
+# the commands don't use the app, so they don't need its context
+@manifest_cli.command(
+    "update", help="Store and index the latest manifest.", with_appcontext=False
+)
+@click.option("--no-stream", is_flag=True, help="Download tables in one piece.")
+def update_manifest(no_stream):
+    manifest = DestinyManifest()
+    manifest.update_manifest_if_needed(stream=not no_stream)
+    click.echo(f"active manifest {manifest.backend.get_active_version()}")
+
+
+@manifest_cli.command(
+    "warmup",
+    help="Update the manifest if needed and load its tables.",
+    with_appcontext=False,
+)
+@click.option("--no-update", is_flag=True, help="Only load the stored manifest.")
+def warmup_manifest(no_update):
+    # run before the workers start, e.g. as a release step, so the manifest they warm is already stored and indexed
+    manifest = DestinyManifest()
+    if not no_update:
+        manifest.update_manifest_if_needed()
+
+    warmup = ManifestWarmup()
+    warmup.run(manifest)
+    click.echo(json.dumps(warmup.stats(), indent=2))
+    if not warmup.ready:
+        raise click.ClickException(warmup.error or "manifest warmup failed")
@@ -1,8 +1,151 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql.schema import MetaData
 
-db = create_engine(os.environ.get("DATABASE_URL"))
+# connections each worker process keeps open, and how many more it opens under load. Postgres needs
+# workers * (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW) connections at most, see /metrics for how many are used
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(os.environ.get("DATABASE_MAX_OVERFLOW", 10))
+# seconds a request waits for a connection when all of them are in use before failing
+DATABASE_POOL_TIMEOUT = float(os.environ.get("DATABASE_POOL_TIMEOUT", 30))
+# connections older than this many seconds are replaced, before a server or proxy idle timeout drops them
+DATABASE_POOL_RECYCLE = int(os.environ.get("DATABASE_POOL_RECYCLE", 30 * 60))
+# test connections with a round trip before handing them out, so one dropped while idle isn't used
+DATABASE_POOL_PRE_PING = os.environ.get("DATABASE_POOL_PRE_PING", "1") == "1"
 
-metadata = MetaData(bind=db)
+metadata = MetaData()
+
+
+def database_config():
+    return {
+        "DATABASE_URL": os.environ.get("DATABASE_URL"),
+        "DATABASE_POOL_SIZE": DATABASE_POOL_SIZE,
+        "DATABASE_MAX_OVERFLOW": DATABASE_MAX_OVERFLOW,
+        "DATABASE_POOL_TIMEOUT": DATABASE_POOL_TIMEOUT,
+        "DATABASE_POOL_RECYCLE": DATABASE_POOL_RECYCLE,
+        "DATABASE_POOL_PRE_PING": DATABASE_POOL_PRE_PING,
+    }
+
+
+def create_db_engine(config):
+    url = make_url(config["DATABASE_URL"])
+    options = {
+        "pool_pre_ping": config["DATABASE_POOL_PRE_PING"],
+        "pool_recycle": config["DATABASE_POOL_RECYCLE"],
+    }
+    # sizing only applies to a QueuePool, sqlite in memory for example gets a pool without overflow or timeout
+    if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        options.update(
+            pool_size=config["DATABASE_POOL_SIZE"],
+            max_overflow=config["DATABASE_MAX_OVERFLOW"],
+            pool_timeout=config["DATABASE_POOL_TIMEOUT"],
+        )
+
+    return create_engine(url, **options)
+
+
+# The engine and its connection pool, one per worker process. create_app configures it from app.config with
+# init_database, anything else gets one configured from the environment the first time it's used.
+class Database:
+    def __init__(self):
+        self.config = None
+        self._engine = None
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait = 0
+        self.max_checkout_wait = 0
+
+    def init_app(self, app):
+        for key, value in database_config().items():
+            app.config.setdefault(key, value)
+
+        self.dispose()
+        with self.lock:
+            self.config = {key: app.config[key] for key in database_config()}
+            self._engine = create_db_engine(self.config)
+        app.extensions["database"] = self
+
+    @property
+    def engine(self):
+        with self.lock:
+            if self._engine is None:
+                self.config = database_config()
+                self._engine = create_db_engine(self.config)
+            return self._engine
+
+    def dispose(self):
+        # closes the pooled connections, gunicorn.conf.py calls this in the master so workers are forked without any
+        if self._engine is not None:
+            self._engine.dispose()
+
+    def dispose_after_fork(self):
+        # a forked process starts with an empty pool and its own stats. The connections it inherited are left
+        # open, closing them would end the sessions of the process they were forked from, which still uses them
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait = 0
+        self.max_checkout_wait = 0
+
+    @contextmanager
+    def begin(self):
+        # like Engine.begin, also timing how long it took to get a connection from the pool
+        engine = self.engine
+        start = time.perf_counter()
+        try:
+            connection = engine.connect()
+        except exc.TimeoutError:
+            with self.lock:
+                self.checkout_timeouts += 1
+            raise
+        wait = time.perf_counter() - start
+        with self.lock:
+            self.checkouts += 1
+            self.checkout_wait += wait
+            self.max_checkout_wait = max(self.max_checkout_wait, wait)
+
+        with connection, connection.begin():
+            yield connection
+
+    def stats(self):
+        pool = self._engine.pool if self._engine is not None else None
+        with self.lock:
+            stats = {
+                "checkouts": self.checkouts,
+                "checkoutTimeouts": self.checkout_timeouts,
+                "checkoutWaitSeconds": self.checkout_wait,
+                "averageCheckoutWaitSeconds": self.checkout_wait / self.checkouts
+                if self.checkouts
+                else 0,
+                "maxCheckoutWaitSeconds": self.max_checkout_wait,
+            }
+
+        if isinstance(pool, QueuePool):
+            stats.update(
+                {
+                    "poolSize": pool.size(),
+                    "maxOverflow": self.config["DATABASE_MAX_OVERFLOW"],
+                    "inUse": pool.checkedout(),
+                    "idle": pool.checkedin(),
+                    "overflow": max(0, pool.overflow()),
+                }
+            )
+        return stats
+
+
+db = Database()
+os.register_at_fork(after_in_child=db.dispose_after_fork)
+
+
+def init_database(app):
+    db.init_app(app)
+    return db
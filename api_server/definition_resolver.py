@@ -0,0 +1,31 @@
+from collections import defaultdict
+
+
+# Collects the definition hashes needed for a request and loads each batch with one lookup per table.
+# The lookup function is injected so the resolver doesn't care where definitions are stored,
+# it only has to look like DestinyManifest.get_definitions(table_name, hashes) -> {str(hash): definition}
+class DefinitionResolver:
+    def __init__(self, get_definitions):
+        self.get_definitions = get_definitions
+        self.resolved = defaultdict(dict)
+
+    def load(self, table_name, hashes):
+        table = self.resolved[table_name]
+        missing = [h for h in dict.fromkeys(str(h) for h in hashes) if h not in table]
+        if not missing:
+            return
+
+        definitions = self.get_definitions(table_name, missing)
+        for h in missing:
+            table[h] = definitions.get(h)
+
+    def get(self, table_name, definition_hash):
+        key = str(definition_hash)
+        table = self.resolved[table_name]
+        if key not in table:
+            # anything that wasn't loaded up front is still looked up, just without batching
+            self.load(table_name, [key])
+        return table[key]
+
+    def table(self, table_name):
+        return {k: v for k, v in self.resolved[table_name].items() if v is not None}
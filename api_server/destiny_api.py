@@ -1,22 +1,31 @@
 import os
+from dataclasses import dataclass
 from enum import Enum
 
 from flask import session
-from requests_oauthlib import OAuth2Session
 
+from api_server.character_cache import character_cache, character_fingerprint
+from api_server.definition_resolver import DefinitionResolver
 from api_server.destiny_manifest import DestinyManifest
+from api_server.http_client import BungieClient, refresh_token, token_expired
+from api_server.loadout_optimizer import LoadoutCandidate
 from api_server.models import (
     BUCKET_HASH_ARMOR_TYPE_MAPPING,
+    EXOTIC_TIER_TYPE,
+    INVENTORY_ITEM_TABLE,
     SUBCLASSS_BUCKET_HASH,
+    TALENT_GRID_INDEX_TABLE,
+    TALENT_GRID_TABLE,
     ArmorPiece,
     AspectSubclass,
     Character,
     FullCharacterData,
     TreeStyleSubclass,
     User,
+    prefetch_socket_definitions,
 )
-
-headers = {"X-API-KEY": os.environ.get("BUNGIE_API_KEY")}
+from api_server.profile_cache import profile_cache
+from api_server.serializers import dump_full_character_data
 
 
 class DestinyComponentType(Enum):
@@ -58,110 +67,101 @@ class DestinyComponentType(Enum):
 
 DESTINY_BASE_URL = "https://www.bungie.net/Platform/Destiny2"
 
+CHARACTER_COMPONENTS = [
+    DestinyComponentType.Characters,
+    DestinyComponentType.CharacterInventories,
+    DestinyComponentType.CharacterEquipment,
+    DestinyComponentType.ItemInstances,
+    DestinyComponentType.ItemSockets,
+    DestinyComponentType.ItemTalentGrids,
+]
 
-class DestinyAPI:
-    def get_client(self):
-        token = session.get("oauth_token")
 
-        client_id = os.environ.get("OAUTH_CLIENT_ID")
-        client_secret = os.environ.get("OAUTH_CLIENT_SECRET")
+# one profile request with the equipment of every character, for get_full_characters_data
+FULL_CHARACTERS_COMPONENTS = [
+    DestinyComponentType.Characters,
+    DestinyComponentType.CharacterEquipment,
+    DestinyComponentType.ItemInstances,
+    DestinyComponentType.ItemSockets,
+    DestinyComponentType.ItemTalentGrids,
+]
 
-        if token is not None:
 
-            auto_refresh_extra = {
-                "client_id": client_id,
-                "client_secret": client_secret,
-            }
+# every armor piece the user has, in the vault, equipped or in a character's inventory
+INVENTORY_COMPONENTS = [
+    DestinyComponentType.ProfileInventories,
+    DestinyComponentType.CharacterInventories,
+    DestinyComponentType.CharacterEquipment,
+    DestinyComponentType.ItemInstances,
+    DestinyComponentType.ItemStats,
+    DestinyComponentType.ItemSockets,
+]
 
-            def token_updater(token):
-                session["oauth_token"] = token
+# number of inventory items whose definitions are loaded together, each batch gets its own resolver so
+# the memory used to build an inventory doesn't grow with its size
+INVENTORY_BATCH_SIZE = int(os.environ.get("INVENTORY_BATCH_SIZE", 100))
 
-            c = OAuth2Session(
-                client_id,
-                token=token,
-                auto_refresh_url=os.environ.get("BUNGIE_TOKEN_URL"),
-                auto_refresh_kwargs=auto_refresh_extra,
-                token_updater=token_updater,
-            )
-            c.headers.update(headers)
-            return c
-        else:
-            state = session.get("oauth_state")
-            client_id = os.environ.get("OAUTH_CLIENT_ID")
-            c = OAuth2Session(client_id, state=state)
-            c.headers.update(headers)
-            return c
 
-    def get_bungie_user_linked_profiles(self):
-        token = session.get("oauth_token")
-        res = (
-            self.get_client()
-            .get(
-                f"{DESTINY_BASE_URL}/254/Profile/{token['membership_id']}/LinkedProfiles/"
-            )
-            .json()
-        )
+def components_query(components):
+    return ",".join([str(c.value) for c in components])
 
-        return User.from_json(res)
 
-    def get_characters(self):
+def linked_profiles_url(token):
+    return f"{DESTINY_BASE_URL}/254/Profile/{token['membership_id']}/LinkedProfiles/"
 
-        membership_type = session.get("destinyMembershipType")
-        membership_id = session.get("destinyMembershipID")
 
-        res = (
-            self.get_client()
-            .get(
-                f"{DESTINY_BASE_URL}/{membership_type}/Profile/{membership_id}/?components={DestinyComponentType.Characters.value}"
-            )
-            .json()
-        )
+def characters_url(membership_type, membership_id):
+    return f"{DESTINY_BASE_URL}/{membership_type}/Profile/{membership_id}/?components={DestinyComponentType.Characters.value}"
 
-        manifest = DestinyManifest()
-        race_defs = manifest.get_table("DestinyRaceDefinition")
 
-        class_defs = manifest.get_table("DestinyClassDefinition")
+def character_url(membership_type, membership_id, character_id):
+    return f"{DESTINY_BASE_URL}/{membership_type}/Profile/{membership_id}/Character/{character_id}?components={components_query(CHARACTER_COMPONENTS)}"
 
-        characters = []
-        for character_data in res["Response"]["characters"]["data"].values():
-            characters.append(
-                Character.from_json(character_data, race_defs, class_defs)
-            )
-        return characters
 
-    def get_character(self, character_id):
+def full_characters_url(membership_type, membership_id):
+    return f"{DESTINY_BASE_URL}/{membership_type}/Profile/{membership_id}/?components={components_query(FULL_CHARACTERS_COMPONENTS)}"
 
-        membership_type = session.get("destinyMembershipType")
-        membership_id = session.get("destinyMembershipID")
 
-        components = [
-            DestinyComponentType.Characters,
-            DestinyComponentType.CharacterInventories,
-            DestinyComponentType.CharacterEquipment,
-            DestinyComponentType.ItemInstances,
-            DestinyComponentType.ItemSockets,
-            DestinyComponentType.ItemTalentGrids,
-        ]
+def inventory_url(membership_type, membership_id):
+    return f"{DESTINY_BASE_URL}/{membership_type}/Profile/{membership_id}/?components={components_query(INVENTORY_COMPONENTS)}"
 
-        res = (
-            self.get_client()
-            .get(
-                f"{DESTINY_BASE_URL}/{membership_type}/Profile/{membership_id}/Character/{character_id}?components={','.join([str(c.value) for c in components])}"
-            )
-            .json()
+
+# The parts of a character profile response that are turned into models. It's shared by DestinyAPI and
+# AsyncDestinyAPI, which only differ in how the response and definitions are fetched
+@dataclass
+class CharacterResponse:
+    character: dict
+    armor: list
+    subclass: dict
+    talent_grid: dict
+    instances: dict
+    sockets: dict
+
+    @classmethod
+    def from_json(self, res):
+        return self.from_components(
+            res["Response"]["character"]["data"],
+            res["Response"]["equipment"]["data"]["items"],
+            res["Response"]["itemComponents"],
         )
 
-        manifest = DestinyManifest()
-        inventory_item_defs = manifest.get_table("DestinyInventoryItemDefinition")
-        race_defs = manifest.get_table("DestinyRaceDefinition")
-        class_defs = manifest.get_table("DestinyClassDefinition")
-        talent_grid_defs = manifest.get_table("DestinyTalentGridDefinition")
+    @classmethod
+    def from_profile_json(self, res):
+        # a profile response has the equipment of every character, item components are shared between them
+        return [
+            self.from_components(
+                character_res,
+                res["Response"]["characterEquipment"]["data"][character_id]["items"],
+                res["Response"]["itemComponents"],
+            )
+            for character_id, character_res in res["Response"]["characters"][
+                "data"
+            ].items()
+        ]
 
-        character_res = res["Response"]["character"]["data"]
-        equipment_res = res["Response"]["equipment"]["data"]["items"]
-        instances = res["Response"]["itemComponents"]["instances"]["data"]
-        sockets = res["Response"]["itemComponents"]["sockets"]["data"]
-        talentGrids = res["Response"]["itemComponents"]["talentGrids"]["data"]
+    @classmethod
+    def from_components(self, character_res, equipment_res, item_components):
+        talent_grids = item_components["talentGrids"]["data"]
 
         armor_responses = [
             e
@@ -169,36 +169,355 @@ class DestinyAPI:
             if e["bucketHash"] in BUCKET_HASH_ARMOR_TYPE_MAPPING.keys()
         ]
 
+        equipment_subclass = [
+            e for e in equipment_res if e["bucketHash"] == SUBCLASSS_BUCKET_HASH
+        ][0]
+
+        return self(
+            character=character_res,
+            armor=armor_responses,
+            subclass=equipment_subclass,
+            talent_grid=talent_grids[str(equipment_subclass["itemInstanceId"])],
+            instances=item_components["instances"]["data"],
+            sockets=item_components["sockets"]["data"],
+        )
+
+    @property
+    def has_aspects(self):
+        return self.talent_grid["talentGridHash"] == 0
+
+
+# The items of a profile response with the inventory components, every instanced item in the vault first and then
+# each character's equipment and inventory. The order is stable for a response so positions in items are used as
+# pagination cursors
+@dataclass
+class InventoryResponse:
+    items: list
+    instances: dict
+    stats: dict
+    sockets: dict
+
+    @classmethod
+    def from_json(self, res):
+        inventories = [res["Response"]["profileInventory"]["data"]["items"]]
+        for character_id, equipment in res["Response"]["characterEquipment"][
+            "data"
+        ].items():
+            inventories.append(equipment["items"])
+            inventories.append(
+                res["Response"]["characterInventories"]["data"][character_id]["items"]
+            )
+
+        return self(
+            items=[i for items in inventories for i in items if "itemInstanceId" in i],
+            instances=res["Response"]["itemComponents"]["instances"]["data"],
+            stats=res["Response"]["itemComponents"]["stats"]["data"],
+            sockets=res["Response"]["itemComponents"]["sockets"]["data"],
+        )
+
+    def item_stats(self, item_instance_id):
+        # stat hash -> value
+        stats = self.stats.get(item_instance_id, {}).get("stats", {})
+        return {int(h): s["value"] for h, s in stats.items()}
+
+
+def armor_bucket_hash(item_def, instance):
+    # items in the vault are in the vault bucket, the armor slot comes from the definition. Armor from before
+    # armor energy existed has no energy and can't take mods, so it's left out
+    if item_def is None or instance is None or "energy" not in instance:
+        return None
+    bucket_hash = item_def.get("inventory", {}).get("bucketTypeHash")
+    if bucket_hash not in BUCKET_HASH_ARMOR_TYPE_MAPPING:
+        return None
+    return bucket_hash
+
+
+def iter_inventory_armor(manifest, inventory_response, start=0, class_type=None):
+    # yields (position after the piece, ArmorPiece) for the armor at or after position start in
+    # inventory_response.items, only the armor of class_type when it's given. Pieces are only built as
+    # they're consumed
+    items = inventory_response.items
+    sockets = inventory_response.sockets
+
+    for batch_start in range(start, len(items), INVENTORY_BATCH_SIZE):
+        batch = items[batch_start : batch_start + INVENTORY_BATCH_SIZE]
+
+        resolver = DefinitionResolver(manifest.get_definitions)
+        resolver.load(INVENTORY_ITEM_TABLE, [i["itemHash"] for i in batch])
+
         armor = []
+        for position, item in enumerate(batch, batch_start + 1):
+            instance = inventory_response.instances.get(item["itemInstanceId"])
+            item_def = resolver.get(INVENTORY_ITEM_TABLE, item["itemHash"])
+            bucket_hash = armor_bucket_hash(item_def, instance)
+            if bucket_hash is None:
+                continue
+            if class_type is not None and item_def["classType"] != class_type:
+                continue
+            armor.append((position, dict(item, bucketHash=bucket_hash), instance))
+
+        prefetch_socket_definitions(
+            resolver,
+            [
+                (ArmorPiece, a["itemHash"], sockets[a["itemInstanceId"]]["sockets"])
+                for _, a, _ in armor
+            ],
+        )
 
-        for a in armor_responses:
-            instance = instances.get(a["itemInstanceId"])
+        for position, a, instance in armor:
             socket_response = sockets[a["itemInstanceId"]]["sockets"]
-            armor.append(
-                ArmorPiece.from_json(a, instance, socket_response, inventory_item_defs)
-            )
+            yield position, ArmorPiece.from_json(a, instance, socket_response, resolver)
 
-        equipment_subclass = [
-            e for e in equipment_res if e["bucketHash"] == SUBCLASSS_BUCKET_HASH
-        ][0]
 
-        talent_grid = talentGrids[str(equipment_subclass["itemInstanceId"])]
+def build_loadout_candidates(manifest, inventory_response, class_type):
+    pieces = [
+        a
+        for _, a in iter_inventory_armor(
+            manifest, inventory_response, class_type=class_type
+        )
+    ]
+
+    resolver = DefinitionResolver(manifest.get_definitions)
+    resolver.load(INVENTORY_ITEM_TABLE, [p.item_hash for p in pieces])
 
-        if talent_grid["talentGridHash"] == 0:
-            subclass_socket_response = sockets[equipment_subclass["itemInstanceId"]][
-                "sockets"
+    return [
+        LoadoutCandidate(
+            piece=p,
+            stats=inventory_response.item_stats(p.item_instance_id),
+            exotic=resolver.get(INVENTORY_ITEM_TABLE, p.item_hash)["inventory"][
+                "tierType"
             ]
-            subclass = AspectSubclass.from_json(
-                equipment_subclass, subclass_socket_response, inventory_item_defs
+            == EXOTIC_TIER_TYPE,
+        )
+        for p in pieces
+    ]
+
+
+def load_race_and_class(resolver, characters_res):
+    resolver.load("DestinyRaceDefinition", [c["raceHash"] for c in characters_res])
+    resolver.load("DestinyClassDefinition", [c["classHash"] for c in characters_res])
+
+
+def build_characters(characters_res, resolver):
+    characters = []
+    for character_data in characters_res:
+        characters.append(
+            Character.from_json(
+                character_data,
+                resolver.table("DestinyRaceDefinition"),
+                resolver.table("DestinyClassDefinition"),
+            )
+        )
+    return characters
+
+
+def prefetch_equipment(resolver, character_responses):
+    # load every definition the armor and subclasses need up front so each table is only queried once per level,
+    # however many characters there are
+    socketed_items = []
+    subclass_hashes = []
+    talent_grid_hashes = []
+    for character_response in character_responses:
+        sockets = character_response.sockets
+        subclass = character_response.subclass
+
+        socketed_items += [
+            (ArmorPiece, a["itemHash"], sockets[a["itemInstanceId"]]["sockets"])
+            for a in character_response.armor
+        ]
+        if character_response.has_aspects:
+            socketed_items.append(
+                (
+                    AspectSubclass,
+                    subclass["itemHash"],
+                    sockets[subclass["itemInstanceId"]]["sockets"],
+                )
             )
         else:
-            subclass = TreeStyleSubclass.from_json(
-                equipment_subclass,
-                talent_grid,
-                inventory_item_defs,
-                talent_grid_defs,
+            subclass_hashes.append(subclass["itemHash"])
+            talent_grid_hashes.append(character_response.talent_grid["talentGridHash"])
+
+    if talent_grid_hashes:
+        resolver.load(TALENT_GRID_INDEX_TABLE, talent_grid_hashes)
+        # manifests stored before talent grid indexes existed need the whole definitions instead
+        resolver.load(
+            TALENT_GRID_TABLE,
+            [
+                h
+                for h in talent_grid_hashes
+                if resolver.get(TALENT_GRID_INDEX_TABLE, h) is None
+            ],
+        )
+    prefetch_socket_definitions(resolver, socketed_items, subclass_hashes)
+
+
+def build_full_character(character_response, resolver):
+    sockets = character_response.sockets
+    equipment_subclass = character_response.subclass
+
+    armor = []
+
+    for a in character_response.armor:
+        instance = character_response.instances.get(a["itemInstanceId"])
+        socket_response = sockets[a["itemInstanceId"]]["sockets"]
+        armor.append(ArmorPiece.from_json(a, instance, socket_response, resolver))
+
+    if character_response.has_aspects:
+        subclass_socket_response = sockets[equipment_subclass["itemInstanceId"]][
+            "sockets"
+        ]
+        subclass = AspectSubclass.from_json(
+            equipment_subclass, subclass_socket_response, resolver
+        )
+    else:
+        subclass = TreeStyleSubclass.from_json(
+            equipment_subclass,
+            character_response.talent_grid,
+            resolver,
+        )
+
+    character = build_characters([character_response.character], resolver)[0]
+
+    return FullCharacterData(character=character, armor=armor, subclass=subclass)
+
+
+def dump_full_characters(manifest, character_responses):
+    # returns the FullCharacterDataSchema output of each character, only the ones that changed since they
+    # were last dumped are built, with one prefetch between them
+    fingerprints = [
+        character_fingerprint(manifest.version, c) for c in character_responses
+    ]
+    dumped = character_cache.get_many(fingerprints)
+
+    missing = [i for i, d in enumerate(dumped) if d is None]
+    if missing:
+        missing_responses = [character_responses[i] for i in missing]
+
+        resolver = DefinitionResolver(manifest.get_definitions)
+        load_race_and_class(resolver, [c.character for c in missing_responses])
+        prefetch_equipment(resolver, missing_responses)
+
+        built = {}
+        for i in missing:
+            dumped[i] = dump_full_character_data(
+                build_full_character(character_responses[i], resolver)
             )
+            built[fingerprints[i]] = dumped[i]
+        character_cache.set_many(built)
+
+    return dumped
+
+
+class DestinyAPI:
+    def get_client(self):
+        # requests share the worker's connection pool, only the user's token is attached per request
+        token = session.get("oauth_token")
+
+        if token is not None and token_expired(token):
+            token = refresh_token(token)
+            session["oauth_token"] = token
+
+        return BungieClient(token)
+
+    def get_profile(self, membership_type, membership_id, url):
+        client = self.get_client()
+        return profile_cache.get(
+            membership_type, membership_id, url, lambda: client.get(url).json()
+        )
+
+    def invalidate_profile(self):
+        # called after anything that changes the user's characters, so the next request sees it
+        profile_cache.invalidate(
+            session.get("destinyMembershipType"), session.get("destinyMembershipID")
+        )
+
+    def get_bungie_user_linked_profiles(self):
+        token = session.get("oauth_token")
+        res = self.get_client().get(linked_profiles_url(token)).json()
+
+        return User.from_json(res)
+
+    def get_characters(self):
+
+        membership_type = session.get("destinyMembershipType")
+        membership_id = session.get("destinyMembershipID")
+
+        res = self.get_profile(
+            membership_type,
+            membership_id,
+            characters_url(membership_type, membership_id),
+        )
+
+        characters_res = list(res["Response"]["characters"]["data"].values())
 
-        character = Character.from_json(character_res, race_defs, class_defs)
+        resolver = DefinitionResolver(DestinyManifest().get_definitions)
+        load_race_and_class(resolver, characters_res)
 
-        return FullCharacterData(character=character, armor=armor, subclass=subclass)
+        return build_characters(characters_res, resolver)
+
+    def get_character_response(self, character_id):
+
+        membership_type = session.get("destinyMembershipType")
+        membership_id = session.get("destinyMembershipID")
+
+        res = self.get_profile(
+            membership_type,
+            membership_id,
+            character_url(membership_type, membership_id, character_id),
+        )
+
+        return CharacterResponse.from_json(res)
+
+    def get_character_data(self, character_id):
+        # the character dumped with FullCharacterDataSchema, cached by equipment fingerprint
+        character_response = self.get_character_response(character_id)
+
+        return dump_full_characters(DestinyManifest(), [character_response])[0]
+
+    def get_full_characters_responses(self):
+
+        membership_type = session.get("destinyMembershipType")
+        membership_id = session.get("destinyMembershipID")
+
+        res = self.get_profile(
+            membership_type,
+            membership_id,
+            full_characters_url(membership_type, membership_id),
+        )
+
+        return CharacterResponse.from_profile_json(res)
+
+    def get_inventory_armor(self, cursor=0):
+        # the profile is fetched here, only building the armor pieces is deferred to the returned generator
+        membership_type = session.get("destinyMembershipType")
+        membership_id = session.get("destinyMembershipID")
+
+        res = self.get_profile(
+            membership_type,
+            membership_id,
+            inventory_url(membership_type, membership_id),
+        )
+
+        return iter_inventory_armor(
+            DestinyManifest(), InventoryResponse.from_json(res), cursor
+        )
+
+    def get_loadout_candidates(self, class_type):
+        # every armor piece of the class with its stats, for optimize_loadout
+        membership_type = session.get("destinyMembershipType")
+        membership_id = session.get("destinyMembershipID")
+
+        res = self.get_profile(
+            membership_type,
+            membership_id,
+            inventory_url(membership_type, membership_id),
+        )
+
+        return build_loadout_candidates(
+            DestinyManifest(), InventoryResponse.from_json(res), class_type
+        )
+
+    def get_full_characters_data(self):
+        return dump_full_characters(
+            DestinyManifest(), self.get_full_characters_responses()
+        )
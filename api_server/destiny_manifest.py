@@ -1,37 +1,456 @@
+import asyncio
+import hashlib
 import json
 import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-import redis
-import requests
+from api_server.http_client import HTTP_TIMEOUT, get_http_session
+from api_server.manifest_backends import INGEST_BATCH_SIZE, get_manifest_backend
+from api_server.manifest_indexes import build_indexes
+from api_server.manifest_projections import (
+    MANIFEST_PROJECTIONS,
+    project_definition,
+    wrap_definition,
+)
+from api_server.manifest_serialization import manifest_serializer
+from api_server.manifest_stream import (
+    STREAM_CHUNK_SIZE,
+    iter_single_table,
+    iter_world_tables,
+)
+from api_server.models import (
+    INVENTORY_ITEM_TABLE,
+    SANDBOX_PERK_TABLE,
+    TALENT_GRID_TABLE,
+)
 
-headers = {"X-API-KEY": os.environ.get("BUNGIE_API_KEY")}
+# upper bound for the in-process manifest cache, in bytes of memory taken by the decoded definitions
+MANIFEST_CACHE_MAX_BYTES = int(
+    os.environ.get("MANIFEST_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+# definitions of a batch whose decoded size is measured, the rest are estimated from their serialized size
+CACHE_SIZE_SAMPLE = 64
 
+# the definition tables the server reads, only these are downloaded and stored unless MANIFEST_TABLES says otherwise
+DEFAULT_MANIFEST_TABLES = [
+    INVENTORY_ITEM_TABLE,
+    "DestinyRaceDefinition",
+    "DestinyClassDefinition",
+    TALENT_GRID_TABLE,
+    SANDBOX_PERK_TABLE,
+]
 
-class DestinyManifest:
+
+def configured_manifest_tables():
+    # MANIFEST_TABLES is a comma separated list of tables, or * to store the whole world content file
+    value = os.environ.get("MANIFEST_TABLES")
+    if value is None:
+        return DEFAULT_MANIFEST_TABLES
+    if value.strip() == "*":
+        return None
+    return [t.strip() for t in value.split(",") if t.strip()]
+
+
+MANIFEST_TABLES = configured_manifest_tables()
+# number of tables downloaded at the same time when only some tables are stored
+MANIFEST_DOWNLOAD_WORKERS = int(os.environ.get("MANIFEST_DOWNLOAD_WORKERS", 5))
+
+
+def stored_version(version, tables, serializer):
+    # the table selection, projections and serialization are part of the stored version so changing them
+    # builds a fresh copy of the manifest instead of rewriting tables that readers are using
+    selection = sorted(tables) if tables is not None else "*"
+    fingerprint = hashlib.sha1(
+        json.dumps(
+            [selection, MANIFEST_PROJECTIONS, serializer.name], sort_keys=True
+        ).encode()
+    ).hexdigest()[:8]
+    return f"{version}+{fingerprint}"
+
+
+def decoded_size(value):
+    # memory taken by a decoded definition, its containers and everything in them
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += sys.getsizeof(k) + decoded_size(v)
+    elif isinstance(value, list):
+        for v in value:
+            size += decoded_size(v)
+    return size
+
+
+def estimate_decoded_size(entries):
+    # entries are (serialized bytes, decoded definition). Decoded definitions take several times their serialized
+    # size, how many depends on the table and the serializer, so the ratio is measured on a sample of the batch
+    if not entries:
+        return 0
+    sample = entries[:: max(1, len(entries) // CACHE_SIZE_SAMPLE)]
+    sample_size = sum(decoded_size(d) for _, d in sample)
+    if len(sample) == len(entries):
+        return sample_size
+
+    serialized = sum(len(v) for v, _ in entries)
+    sample_serialized = sum(len(v) for v, _ in sample)
+    return int(serialized * sample_size / max(1, sample_serialized))
+
+
+class CachedTable:
     def __init__(self):
-        self.redis = redis.Redis.from_url(
-            os.environ.get("REDIS_URL"), decode_responses=True
+        # definitions that don't exist in the table are cached as None so they aren't requested again
+        self.definitions = {}
+        self.size = 0
+        self.complete = False
+
+
+# Process wide cache of decoded manifest definitions. Tables are filled lazily as definitions are requested and
+# evicted least recently used first once the decoded definitions take more than max_bytes of memory. Everything is
+# dropped when a different manifest version is seen.
+class ManifestCache:
+    def __init__(self, max_bytes=MANIFEST_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.tables = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # called with the previous and the new version after the cache is emptied for a new version
+        self.version_listeners = []
+
+    def sync_version(self, version):
+        with self.lock:
+            if version == self.version:
+                return
+            previous_version = self.version
+            self.tables.clear()
+            self.size = 0
+            self.version = version
+
+        for listener in self.version_listeners:
+            listener(previous_version, version)
+
+    def lookup(self, version, table_name, keys):
+        # the cache only answers for its own version, a request pinned to another one reads the backend
+        with self.lock:
+            table = self.tables.get(table_name) if version == self.version else None
+            if table is None:
+                self.misses += len(keys)
+                return {}, list(keys)
+
+            self.tables.move_to_end(table_name)
+            found = {}
+            missing = []
+            for key in keys:
+                if key in table.definitions:
+                    found[key] = table.definitions[key]
+                elif not table.complete:
+                    missing.append(key)
+                else:
+                    found[key] = None
+            self.hits += len(found)
+            self.misses += len(missing)
+            return found, missing
+
+    def lookup_table(self, version, table_name):
+        with self.lock:
+            table = self.tables.get(table_name) if version == self.version else None
+            if table is None or not table.complete:
+                self.misses += 1
+                return None
+
+            self.tables.move_to_end(table_name)
+            self.hits += 1
+            return {k: v for k, v in table.definitions.items() if v is not None}
+
+    def has_table(self, version, table_name):
+        # whether the whole table is cached for the version
+        with self.lock:
+            table = self.tables.get(table_name) if version == self.version else None
+            return table is not None and table.complete
+
+    def store(self, version, table_name, definitions, size, complete=False):
+        with self.lock:
+            if version != self.version:
+                return
+
+            table = self.tables.get(table_name)
+            if table is None or complete:
+                if table is not None:
+                    self.size -= table.size
+                table = self.tables[table_name] = CachedTable()
+            else:
+                # a concurrent miss on the same keys may have stored some of them already, only the definitions
+                # that are new add to the size, their share of the batch's size
+                new = {
+                    k: v for k, v in definitions.items() if k not in table.definitions
+                }
+                stored = sum(1 for v in definitions.values() if v is not None)
+                if len(new) < len(definitions) and stored:
+                    size = (
+                        size * sum(1 for v in new.values() if v is not None) // stored
+                    )
+                definitions = new
+            self.tables.move_to_end(table_name)
+
+            table.definitions.update(definitions)
+            table.size += size
+            table.complete = table.complete or complete
+            self.size += size
+
+            while self.size > self.max_bytes and self.tables:
+                _, evicted = self.tables.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "version": self.version,
+                "tables": list(self.tables.keys()),
+                "size": self.size,
+                "maxSize": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+manifest_cache = ManifestCache()
+
+
+class DestinyManifest:
+    def __init__(
+        self,
+        cache=manifest_cache,
+        tables=MANIFEST_TABLES,
+        serializer=manifest_serializer,
+        backend=None,
+    ):
+        self.backend = backend if backend is not None else get_manifest_backend()
+        self.cache = cache
+        self.tables = tables
+        self.serializer = serializer
+        self._version = None
+
+    @property
+    def version(self):
+        # the version is read once per DestinyManifest so a request sees a single manifest version, even if
+        # a new one is activated while it's running
+        if self._version is None:
+            self._version = self.backend.get_active_version()
+            self.cache.sync_version(self._version)
+        return self._version
+
+    def update_manifest_if_needed(self, stream=True):
+        urls = (
+            get_http_session()
+            .get(
+                "https://www.bungie.net/Platform/Destiny2/Manifest/",
+                timeout=HTTP_TIMEOUT,
+            )
+            .json()
+        )
+
+        version = stored_version(
+            urls["Response"]["version"], self.tables, self.serializer
         )
+        saved_manifest_version = self.backend.get_active_version()
+
+        if version == saved_manifest_version:
+            return
+
+        if not self.backend.acquire_update_lock(version):
+            return
 
-    def update_manifest_if_needed(self):
-        urls = requests.get(
-            "https://www.bungie.net/Platform/Destiny2/Manifest/", headers=headers
-        ).json()
+        try:
+            self.backend.register_version(version)
 
-        version = urls["Response"]["version"]
-        saved_manifest_version = self.redis.get("manifest:version")
+            # the new version is stored on its own, readers don't see any of it until it's activated
+            if self.tables is None:
+                self.store_world(
+                    version, urls["Response"]["jsonWorldContentPaths"]["en"], stream
+                )
+            else:
+                self.store_component_tables(
+                    version,
+                    urls["Response"]["jsonWorldComponentContentPaths"]["en"],
+                    stream,
+                )
 
-        if version != saved_manifest_version:
-            content_path = urls["Response"]["jsonWorldContentPaths"]["en"]
-            data = requests.get(
-                f"https://bungie.net/{content_path}", headers=headers
-            ).json()
-            self.redis.set("manifest:version", version)
+            build_indexes(self, version)
 
+            self.backend.activate_version(version)
+        finally:
+            self.backend.release_update_lock()
+
+        self._version = version
+        self.cache.sync_version(version)
+
+        # done before returning, the update runs from the cli which exits as soon as it returns
+        self.backend.remove_old_versions()
+
+    def store_world(self, version, content_path, stream):
+        content_url = f"https://bungie.net/{content_path}"
+        if stream:
+            # parse the download one definition at a time instead of loading the whole world into memory
+            with get_http_session().get(
+                content_url, stream=True, timeout=HTTP_TIMEOUT
+            ) as res:
+                res.raise_for_status()
+                chunks = res.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+                for table_name, definitions in iter_world_tables(chunks):
+                    self.store_definitions(version, table_name, definitions)
+        else:
+            data = get_http_session().get(content_url, timeout=HTTP_TIMEOUT).json()
             for table_name, table_data in data.items():
-                self.redis.set(f"manifest:{table_name}", json.dumps(table_data))
+                self.store_table(version, table_name, table_data)
+
+    def store_component_tables(self, version, component_content_paths, stream):
+        # each table has its own content file, so only the configured tables are downloaded, in parallel
+        with ThreadPoolExecutor(max_workers=MANIFEST_DOWNLOAD_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    self.store_component_table,
+                    version,
+                    table_name,
+                    component_content_paths[table_name],
+                    stream,
+                )
+                for table_name in self.tables
+            ]
+            for future in futures:
+                future.result()
+
+    def store_component_table(self, version, table_name, content_path, stream):
+        content_url = f"https://bungie.net/{content_path}"
+        if stream:
+            with get_http_session().get(
+                content_url, stream=True, timeout=HTTP_TIMEOUT
+            ) as res:
+                res.raise_for_status()
+                chunks = res.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+                self.store_definitions(version, table_name, iter_single_table(chunks))
+        else:
+            table_data = (
+                get_http_session().get(content_url, timeout=HTTP_TIMEOUT).json()
+            )
+            self.store_table(version, table_name, table_data)
+
+    def store_table(self, version, table_name, table_data):
+        self.store_definitions(version, table_name, table_data.items())
+
+    def store_definitions(self, version, table_name, definitions):
+        # definitions can be any iterable of (hash, definition), they're serialized as the backend consumes them
+        self.backend.store_table(
+            version,
+            table_name,
+            (
+                (
+                    definition_hash,
+                    self.serializer.dumps(project_definition(table_name, definition)),
+                )
+                for definition_hash, definition in definitions
+            ),
+        )
+
+    def iter_table_batches(self, version, table_name):
+        # yields the stored table as dicts of at most INGEST_BATCH_SIZE definitions, bypassing the cache
+        batch = {}
+        for definition_hash, value in self.backend.iter_table(version, table_name):
+            batch[definition_hash] = self.serializer.loads(value)
+            if len(batch) >= INGEST_BATCH_SIZE:
+                yield batch
+                batch = {}
+        if batch:
+            yield batch
+
+    def load_definitions(self, version, table_name, hashes):
+        # reads definitions straight from the backend, bypassing the cache
+        keys = list(dict.fromkeys(str(h) for h in hashes))
+        if not keys:
+            return {}
+
+        values = self.backend.load(version, table_name, keys)
+
+        return {
+            k: self.serializer.loads(v) for k, v in zip(keys, values) if v is not None
+        }
+
+    def get_definitions(self, table_name, hashes):
+        # returns a dict of str(hash) -> definition, hashes that don't exist in the table are left out
+        keys = list(dict.fromkeys(str(h) for h in hashes))
+        if not keys:
+            return {}
+
+        version = self.version
+        definitions, missing = self.cache.lookup(version, table_name, keys)
+
+        if missing:
+            values = self.backend.load(version, table_name, missing)
+            loaded = {
+                k: wrap_definition(table_name, self.serializer.loads(v))
+                if v is not None
+                else None
+                for k, v in zip(missing, values)
+            }
+            size = estimate_decoded_size(
+                [(v, loaded[k]) for k, v in zip(missing, values) if v is not None]
+            )
+            self.cache.store(version, table_name, loaded, size)
+            definitions.update(loaded)
+
+        return {k: v for k, v in definitions.items() if v is not None}
+
+    def get_definition(self, table_name, definition_hash):
+        return self.get_definitions(table_name, [definition_hash]).get(
+            str(definition_hash)
+        )
 
     def get_table(self, table_name):
-        data = self.redis.get(f"manifest:{table_name}")
+        version = self.version
+        table = self.cache.lookup_table(version, table_name)
+        if table is not None:
+            return table
+
+        data = self.backend.load_table(version, table_name)
+        table = {
+            k: wrap_definition(table_name, self.serializer.loads(v))
+            for k, v in data.items()
+        }
+        self.cache.store(
+            version,
+            table_name,
+            table,
+            estimate_decoded_size([(v, table[k]) for k, v in data.items()]),
+            complete=True,
+        )
+
+        return table
+
+
+# DestinyManifest for asyncio code, lookups run on a worker thread so they don't block the event loop
+# while redis or the page cache is read
+class AsyncDestinyManifest:
+    def __init__(self, manifest=None):
+        self.manifest = manifest if manifest is not None else DestinyManifest()
+
+    async def get_version(self):
+        return await asyncio.to_thread(lambda: self.manifest.version)
+
+    async def get_definitions(self, table_name, hashes):
+        return await asyncio.to_thread(
+            self.manifest.get_definitions, table_name, hashes
+        )
+
+    async def get_definition(self, table_name, definition_hash):
+        return await asyncio.to_thread(
+            self.manifest.get_definition, table_name, definition_hash
+        )
 
-        return json.loads(data)
+    async def get_table(self, table_name):
+        return await asyncio.to_thread(self.manifest.get_table, table_name)
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase
+from requests_oauthlib import OAuth2Session
+from urllib3.util.retry import Retry
+
+headers = {"X-API-KEY": os.environ.get("BUNGIE_API_KEY")}
+
+# connections kept open per host, sized for the number of requests a worker makes to bungie.net at once
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", 4))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 20))
+# retries for connection errors and throttled or failed responses, waiting backoff * 2^n seconds between them
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 3))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", 0.5))
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 30))
+
+# tokens are refreshed when they have less than this many seconds left so they don't expire mid request
+TOKEN_REFRESH_MARGIN = 60
+
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+def create_http_session():
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=HTTP_RETRY_STATUSES,
+        allowed_methods=["HEAD", "GET", "OPTIONS"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+
+    http_session = requests.Session()
+    # the session is shared by every user's requests, a cookie bungie.net sets for one user must not be sent
+    # with the next user's requests
+    http_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    http_session.mount("https://", adapter)
+    http_session.mount("http://", adapter)
+    http_session.headers.update(headers)
+    return http_session
+
+
+def get_http_session():
+    # one session, and so one pool of keep-alive connections, per worker process. it's created again after a fork
+    # so workers never share sockets with the process they were forked from
+    global _http_session, _http_session_pid
+    with _http_session_lock:
+        if _http_session is None or _http_session_pid != os.getpid():
+            _http_session = create_http_session()
+            _http_session_pid = os.getpid()
+        return _http_session
+
+
+class BearerToken(AuthBase):
+    def __init__(self, token):
+        self.token = token
+
+    def __call__(self, request):
+        request.headers["Authorization"] = f"Bearer {self.token['access_token']}"
+        return request
+
+
+def token_expired(token):
+    expires_at = token.get("expires_at")
+    return expires_at is not None and expires_at - TOKEN_REFRESH_MARGIN < time.time()
+
+
+def refresh_token(token):
+    client_id = os.environ.get("OAUTH_CLIENT_ID")
+    client_secret = os.environ.get("OAUTH_CLIENT_SECRET")
+
+    oauth = OAuth2Session(client_id, token=token)
+    return oauth.refresh_token(
+        os.environ.get("BUNGIE_TOKEN_URL"),
+        client_id=client_id,
+        client_secret=client_secret,
+    )
+
+
+# Sends requests through the shared session with a single user's credentials. It's cheap to make,
+# so one is made per request instead of a session per user.
+class BungieClient:
+    def __init__(self, token=None):
+        self.auth = BearerToken(token) if token is not None else None
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        return get_http_session().get(url, auth=self.auth, **kwargs)
+
+
+# The asyncio counterpart of BungieClient. httpx connections belong to the event loop they were opened on, so
+# a client is made per request (every async flask view runs on its own loop) and concurrent calls within the
+# request share its pool. It's used as an async context manager so the connections are closed with the loop.
+class AsyncBungieClient:
+    def __init__(self, token=None):
+        self.token = token
+        self.client = httpx.AsyncClient(
+            # requests leaves out headers set to None, httpx refuses them
+            headers={k: v for k, v in headers.items() if v is not None},
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+            timeout=HTTP_TIMEOUT,
+            transport=httpx.AsyncHTTPTransport(retries=HTTP_RETRIES),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def get(self, url, **kwargs):
+        request_headers = {}
+        if self.token is not None:
+            request_headers["Authorization"] = f"Bearer {self.token['access_token']}"
+
+        # the transport only retries failed connections, throttled and failed responses are retried here
+        # the same way the sync session's Retry does
+        for attempt in range(HTTP_RETRIES + 1):
+            res = await self.client.get(url, headers=request_headers, **kwargs)
+            if res.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_RETRIES:
+                return res
+            await asyncio.sleep(retry_delay(res, attempt))
+
+
+def retry_delay(res, attempt):
+    retry_after = res.headers.get("Retry-After")
+    if retry_after is not None and retry_after.isdigit():
+        return int(retry_after)
+    return HTTP_RETRY_BACKOFF * 2**attempt
@@ -0,0 +1,98 @@
+import dataclasses
+import json
+import os
+from enum import Enum
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Encodes response bodies straight to bytes. flask 2.0 has no pluggable json provider, so create_app installs one of
+# these on the app and the routes return json_response(...) instead of jsonify(...). The output is the same json
+# jsonify produces, keys sorted, except that non ascii characters are written as utf-8 instead of escaped.
+
+
+def default(value):
+    # what neither encoder handles by itself, orjson already encodes dataclasses and enums natively
+    if isinstance(value, Enum):
+        return value.value
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    raise TypeError(f"{type(value).__name__} isn't JSON serializable")
+
+
+class OrjsonEncoder:
+    name = "orjson"
+
+    def dumps(self, value):
+        return orjson.dumps(
+            value,
+            default=default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+        )
+
+
+class StdlibEncoder:
+    name = "json"
+
+    def dumps(self, value):
+        return json.dumps(
+            value,
+            default=default,
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        ).encode()
+
+
+def get_json_encoder(name):
+    # orjson falls back to the standard library when it isn't installed
+    if name == "orjson" and orjson is not None:
+        return OrjsonEncoder()
+    if name in ("json", "orjson"):
+        return StdlibEncoder()
+    raise ValueError(f"unknown json encoder {name}")
+
+
+def init_json(app):
+    app.config.setdefault("JSON_ENCODER", os.environ.get("JSON_ENCODER", "orjson"))
+    app.extensions["json_encoder"] = get_json_encoder(app.config["JSON_ENCODER"])
+
+
+def json_response(value, status=200):
+    encoder = current_app.extensions["json_encoder"]
+    return current_app.response_class(
+        encoder.dumps(value), status=status, mimetype="application/json"
+    )
+
+
+def iter_json_page(encoder, entries, limit):
+    # entries yields (cursor, value) pairs, where cursor is where the page after value starts. Up to limit values
+    # are encoded one at a time as they're produced, followed by the cursor of the next page, or null when
+    # entries ran out first
+    yield b'{"items":['
+    count = 0
+    cursor = None
+    for cursor, value in entries:
+        if count:
+            yield b","
+        yield encoder.dumps(value)
+        count += 1
+        if count >= limit:
+            break
+    else:
+        cursor = None
+    yield b'],"nextCursor":' + encoder.dumps(cursor) + b"}"
+
+
+def json_page_response(entries, limit, status=200):
+    # a page of a list that can be too large to build in memory, see iter_json_page
+    encoder = current_app.extensions["json_encoder"]
+    return current_app.response_class(
+        iter_json_page(encoder, entries, limit),
+        status=status,
+        mimetype="application/json",
+    )
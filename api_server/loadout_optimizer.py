@@ -0,0 +1,335 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+
+from api_server.mod_fit import ArmorColumns
+from api_server.models import ArmorPiece, ArmorType, Loadout
+
+# Picks an armor piece for every slot that maximizes the requested stats. Stats count in tiers of STAT_TIER_SIZE
+# points up to MAX_STAT_TIER, so loadouts are ranked by their total tiers of the requested stats, then by their
+# points up to the last tier. Only one exotic piece can be worn.
+#
+# Every combination of a full vault is too many to try, so the search is a depth first branch and bound:
+#   - pieces another piece in the same slot is at least as good as in every stat are dropped up front
+#   - a partial loadout is abandoned once it can't beat the best one found even with the highest stats
+#     left in each remaining slot, or can't reach the minimum stats, see loadout_bound
+#   - the slot with the fewest pieces is searched first and pieces are tried best first, so a good
+#     loadout is found early and prunes the rest
+# The search stops at a time budget and returns the best loadout found by then.
+
+STAT_TIER_SIZE = 10
+MAX_STAT_TIER = 10
+MAX_STAT_VALUE = STAT_TIER_SIZE * MAX_STAT_TIER
+
+# seconds a search can take, requests can ask for less or up to LOADOUT_MAX_TIME_BUDGET
+LOADOUT_TIME_BUDGET = float(os.environ.get("LOADOUT_TIME_BUDGET", 2))
+LOADOUT_MAX_TIME_BUDGET = float(os.environ.get("LOADOUT_MAX_TIME_BUDGET", 10))
+# processes the pieces of the first slot are split between, 0 searches in the calling thread. The fan-out hasn't
+# been faster than searching in the calling thread in benchmarks/loadout_optimizer.py yet, leave it off unless it
+# is on the hardware it runs on
+LOADOUT_SEARCH_WORKERS = int(os.environ.get("LOADOUT_SEARCH_WORKERS", 0))
+# seconds searched in the calling thread before the search is split between processes, most searches finish
+# in that time and the ones that don't start the processes with the best loadout found so far to prune with
+LOADOUT_SERIAL_TIME = float(os.environ.get("LOADOUT_SERIAL_TIME", 0.1))
+# loadouts searched between checks of the time budget
+DEADLINE_CHECK_INTERVAL = 1024
+
+
+@dataclass
+class LoadoutCandidate:
+    __slots__ = ("piece", "stats", "exotic")
+
+    piece: ArmorPiece
+    # stat hash -> value, from the item's ItemStats component
+    stats: Dict[int, int]
+    exotic: bool
+
+
+def loadout_score(totals, scored):
+    # the tiers of the first scored stats, ties broken by their points
+    tiers = 0
+    points = 0
+    for total in totals[:scored]:
+        tiers += min(total // STAT_TIER_SIZE, MAX_STAT_TIER)
+        points += min(total, MAX_STAT_VALUE)
+    return tiers * (MAX_STAT_VALUE * scored + 1) + points
+
+
+def loadout_bound(best_totals, best_scored_total, scored):
+    # the highest score a loadout can still reach. best_totals is the most each stat can reach on its own, but
+    # those come from different pieces. A piece only has so many points, so the tiers and points of the scored
+    # stats together can't be more than best_scored_total, what the best pieces for them add up to
+    tiers = 0
+    points = 0
+    for total in best_totals[:scored]:
+        tiers += min(total // STAT_TIER_SIZE, MAX_STAT_TIER)
+        points += min(total, MAX_STAT_VALUE)
+    tiers = min(tiers, best_scored_total // STAT_TIER_SIZE)
+    points = min(points, best_scored_total)
+    return tiers * (MAX_STAT_VALUE * scored + 1) + points
+
+
+def stat_tiers(totals, scored):
+    return sum(min(t // STAT_TIER_SIZE, MAX_STAT_TIER) for t in totals[:scored])
+
+
+def non_dominated(stats, exotic):
+    # indexes of the pieces no other piece can replace without losing a stat. A legendary piece can replace an
+    # exotic one but not the other way around, of identical pieces the first one is kept
+    index = np.arange(len(stats))
+    at_least = np.all(stats[None, :, :] >= stats[:, None, :], axis=2)
+    better = np.any(stats[None, :, :] > stats[:, None, :], axis=2)
+    replaceable = exotic[:, None] | ~exotic[None, :]
+    less_constrained = exotic[:, None] & ~exotic[None, :]
+    dominated = (
+        at_least
+        & replaceable
+        & (better | less_constrained | (index[None, :] < index[:, None]))
+    )
+    return np.flatnonzero(~dominated.any(axis=1))
+
+
+def remaining_maxima(slots, scored, legendary_only):
+    # remaining[i] is the most each stat can gain from the slots from i on, and the most all the scored
+    # stats can gain together
+    stat_count = len(slots[0][0][0]) if slots and slots[0] else 0
+    remaining = [((0,) * stat_count, 0)]
+    for pieces in reversed(slots):
+        maxima = [0] * stat_count
+        scored_maximum = 0
+        for stats, exotic in pieces:
+            if legendary_only and exotic:
+                continue
+            maxima = [max(m, s) for m, s in zip(maxima, stats)]
+            scored_maximum = max(scored_maximum, sum(stats[:scored]))
+        stat_maxima, scored_maxima = remaining[-1]
+        remaining.append(
+            (
+                tuple(m + r for m, r in zip(maxima, stat_maxima)),
+                scored_maximum + scored_maxima,
+            )
+        )
+    return remaining[::-1]
+
+
+class LoadoutSearch:
+    def __init__(self, slots, minimums, scored, deadline, bound=-1, shared=None):
+        # slots has a list of (stats, exotic) per armor slot in search order, stats are tuples in the order
+        # of minimums and the first scored of them count towards the score
+        self.slots = slots
+        self.minimums = minimums
+        self.scored = scored
+        self.deadline = deadline
+        # only loadouts scoring higher than bound are looked for. It's raised by every loadout found and by the
+        # other processes' loadouts, so it can be higher than best_score, the score of this search's own best
+        self.bound = bound
+        self.best_score = -1
+        self.best = None
+        # the best score of all the processes searching the same loadouts, read and raised every
+        # DEADLINE_CHECK_INTERVAL so they prune with each other's loadouts. It isn't locked, racing writes can
+        # only lower it, which prunes less but doesn't change the result
+        self.shared = shared
+        self.searched = 0
+        self.timed_out = False
+        self.remaining = remaining_maxima(slots, scored, False)
+        self.remaining_legendary = remaining_maxima(slots, scored, True)
+
+    def run(self):
+        self.search(0, (0,) * len(self.minimums), False, [])
+        return self
+
+    def share_best_score(self):
+        shared_score = self.shared.value
+        if shared_score > self.bound:
+            self.bound = shared_score
+        elif shared_score < self.bound:
+            self.shared.value = self.bound
+
+    def search(self, depth, totals, exotic, chosen):
+        self.searched += 1
+        if self.searched % DEADLINE_CHECK_INTERVAL == 0:
+            if time.time() > self.deadline:
+                self.timed_out = True
+            if self.shared is not None:
+                self.share_best_score()
+        if self.timed_out:
+            return
+
+        remaining, remaining_scored = (
+            self.remaining_legendary if exotic else self.remaining
+        )[depth]
+        best_totals = [t + r for t, r in zip(totals, remaining)]
+        if any(t < m for t, m in zip(best_totals, self.minimums)):
+            return
+        best_scored_total = sum(totals[: self.scored]) + remaining_scored
+        if loadout_bound(best_totals, best_scored_total, self.scored) <= self.bound:
+            return
+
+        if depth == len(self.slots):
+            # with nothing left to pick best_totals are the totals
+            self.best_score = self.bound = loadout_score(totals, self.scored)
+            self.best = list(chosen)
+            return
+
+        for index, (stats, piece_exotic) in enumerate(self.slots[depth]):
+            if exotic and piece_exotic:
+                continue
+            chosen.append(index)
+            self.search(
+                depth + 1,
+                tuple(t + s for t, s in zip(totals, stats)),
+                exotic or piece_exotic,
+                chosen,
+            )
+            chosen.pop()
+            if self.timed_out:
+                return
+
+
+def search_slots(slots, minimums, scored, deadline, shared):
+    # runs in the search processes
+    search = LoadoutSearch(
+        slots, minimums, scored, deadline, shared.value, shared
+    ).run()
+    search.share_best_score()
+    return search.best_score, search.best, search.searched, search.timed_out
+
+
+_search_pool = None
+_search_pool_pid = None
+_search_pool_workers = None
+_search_manager = None
+_search_pool_lock = threading.Lock()
+
+
+def get_search_pool(workers):
+    # one pool per worker process. The web workers are threaded, so the search processes are started from a fork
+    # server instead of forking a worker in the middle of other requests. The manager holds the best scores
+    # the processes share
+    global _search_pool, _search_pool_pid, _search_pool_workers, _search_manager
+    with _search_pool_lock:
+        context = multiprocessing.get_context("forkserver")
+        if _search_pool_pid != os.getpid():
+            _search_manager = context.Manager()
+        if _search_pool_pid != os.getpid() or _search_pool_workers != workers:
+            if _search_pool is not None and _search_pool_pid == os.getpid():
+                _search_pool.shutdown(wait=False)
+            _search_pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _search_pool_pid = os.getpid()
+            _search_pool_workers = workers
+        return _search_pool, _search_manager
+
+
+def search_loadout(
+    slots, minimums, scored, deadline, workers, serial_time=LOADOUT_SERIAL_TIME
+):
+    # returns (the chosen index in each slot or None, its score, loadouts searched, whether the search finished)
+    if workers <= 1 or len(slots[0]) < 2:
+        search = LoadoutSearch(slots, minimums, scored, deadline).run()
+        return search.best, search.best_score, search.searched, not search.timed_out
+
+    # a serial_time of 0 splits the search right away
+    serial_deadline = min(deadline, time.time() + serial_time)
+    search = LoadoutSearch(slots, minimums, scored, serial_deadline)
+    if serial_time > 0:
+        search.run()
+        if not search.timed_out or time.time() > deadline:
+            return search.best, search.best_score, search.searched, not search.timed_out
+
+    # the pieces of the first slot are dealt out best first so every process gets some of the good ones
+    pool, manager = get_search_pool(workers)
+    shared = manager.Value("q", search.bound)
+    chunks = [list(range(len(slots[0])))[i::workers] for i in range(workers)]
+    futures = [
+        pool.submit(
+            search_slots,
+            [[slots[0][i] for i in chunk]] + slots[1:],
+            minimums,
+            scored,
+            deadline,
+            shared,
+        )
+        for chunk in chunks
+    ]
+
+    best_score = search.best_score
+    best = search.best
+    searched = search.searched
+    complete = True
+    for chunk, future in zip(chunks, futures):
+        score, chosen, chunk_searched, timed_out = future.result()
+        searched += chunk_searched
+        complete = complete and not timed_out
+        if chosen is not None and score > best_score:
+            best_score = score
+            best = [chunk[chosen[0]]] + chosen[1:]
+    return best, best_score, searched, complete
+
+
+def optimize_loadout(
+    candidates,
+    stat_hashes,
+    minimums=None,
+    mods=None,
+    time_budget=LOADOUT_TIME_BUDGET,
+    workers=LOADOUT_SEARCH_WORKERS,
+    serial_time=LOADOUT_SERIAL_TIME,
+):
+    # candidates are LoadoutCandidates of one class, mods maps an ArmorType to the mods its piece has to fit.
+    # minimums maps a stat hash to the least the loadout can have of it, it doesn't need to be in stat_hashes.
+    # Returns a Loadout, or None when no loadout fits the mods and minimums or none was found in time
+    deadline = time.time() + time_budget
+    minimums = minimums or {}
+    mods = mods or {}
+    stat_vector = list(stat_hashes) + [h for h in minimums if h not in stat_hashes]
+
+    slots = []
+    for armor_type in ArmorType:
+        slot = [c for c in candidates if c.piece.item_type == armor_type]
+        if mods.get(armor_type) and slot:
+            fits = ArmorColumns([c.piece for c in slot]).fits([mods[armor_type]])[0]
+            slot = [c for c, fit in zip(slot, fits) if fit]
+        if not slot:
+            return None
+
+        stats = np.array(
+            [[c.stats.get(h, 0) for h in stat_vector] for c in slot], dtype=np.int32
+        ).reshape(len(slot), len(stat_vector))
+        exotic = np.array([c.exotic for c in slot], dtype=bool)
+        slot = [slot[i] for i in non_dominated(stats, exotic)]
+        # best first, by the points they add to the scored stats
+        slot.sort(key=lambda c: -sum(c.stats.get(h, 0) for h in stat_hashes))
+        slots.append(slot)
+
+    slots.sort(key=len)
+    best, _, searched, complete = search_loadout(
+        [
+            [(tuple(c.stats.get(h, 0) for h in stat_vector), c.exotic) for c in slot]
+            for slot in slots
+        ],
+        tuple(minimums.get(h, 0) for h in stat_vector),
+        len(stat_hashes),
+        deadline,
+        workers,
+        serial_time,
+    )
+    if best is None:
+        return None
+
+    chosen = [slot[i] for slot, i in zip(slots, best)]
+    chosen.sort(key=lambda c: c.piece.item_type)
+    totals = [sum(c.stats.get(h, 0) for c in chosen) for h in stat_vector]
+
+    return Loadout(
+        armor=[c.piece for c in chosen],
+        stats={str(h): t for h, t in zip(stat_vector, totals)},
+        tiers=stat_tiers(totals, len(stat_hashes)),
+        complete=complete,
+        searched=searched,
+    )
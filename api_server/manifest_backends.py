@@ -0,0 +1,442 @@
+import fcntl
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import uuid
+from itertools import islice
+
+from api_server.redis_client import get_binary_redis, get_redis
+
+# Backends store the serialized definitions of each manifest version and keep track of which version is active.
+# They only deal in bytes, serialization, projection and caching happen in DestinyManifest.
+
+# number of definitions written per HSET when storing a table
+INGEST_BATCH_SIZE = 1000
+# number of HSETs queued in a pipeline before it's sent to redis
+INGEST_PIPELINE_DEPTH = 10
+
+# how many manifest versions are kept, the active one plus the previous ones so requests that pinned
+# an older version before a swap can still finish
+MANIFEST_RETAINED_VERSIONS = int(os.environ.get("MANIFEST_RETAINED_VERSIONS", 2))
+
+# points at the manifest version readers should use, it's only changed once a version is completely stored
+ACTIVE_VERSION_KEY = "manifest:active-version"
+# every stored version scored by the time it was activated
+VERSIONS_KEY = "manifest:versions"
+UPDATE_LOCK_KEY = "manifest:update-lock"
+UPDATE_LOCK_TIMEOUT = 60 * 60
+# deletes the update lock only if it still holds this update's token, once it expired another worker may hold it
+RELEASE_UPDATE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# keys of the unversioned layouts manifests were stored in before, manifest:version held the raw bungie version
+# with each table as a json blob (manifest:<table>) or a hash (manifest:table:<table>)
+LEGACY_VERSION_KEY = "manifest:version"
+LEGACY_KEY_PATTERNS = ["manifest:Destiny*", "manifest:table:*"]
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def version_prefix(version):
+    return f"manifest:{version}"
+
+
+def table_key(version, table_name):
+    return f"{version_prefix(version)}:table:{table_name}"
+
+
+def update_lock_version(value):
+    # the lock holds the version being built followed by the token of the update building it
+    return value.split(" ", 1)[0] if value is not None else None
+
+
+class RedisManifestBackend:
+    def __init__(self):
+        self.redis = get_redis()
+        self.definitions_redis = get_binary_redis()
+        self.update_lock_value = None
+        self.release_update_lock_script = self.redis.register_script(
+            RELEASE_UPDATE_LOCK_SCRIPT
+        )
+
+    def get_active_version(self):
+        return self.redis.get(ACTIVE_VERSION_KEY)
+
+    def acquire_update_lock(self, version):
+        # only one worker builds a new version, the others keep serving the active one
+        value = f"{version} {uuid.uuid4().hex}"
+        if not self.redis.set(UPDATE_LOCK_KEY, value, nx=True, ex=UPDATE_LOCK_TIMEOUT):
+            return False
+        self.update_lock_value = value
+        return True
+
+    def release_update_lock(self):
+        if self.update_lock_value is not None:
+            self.release_update_lock_script(
+                keys=[UPDATE_LOCK_KEY], args=[self.update_lock_value]
+            )
+            self.update_lock_value = None
+
+    def register_version(self, version):
+        # registered before anything is written so a build that fails part way is still cleaned up
+        self.redis.zadd(VERSIONS_KEY, {version: 0})
+
+    def activate_version(self, version):
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.zadd(VERSIONS_KEY, {version: time.time()})
+        pipeline.set(ACTIVE_VERSION_KEY, version)
+        pipeline.execute()
+
+    def remove_old_versions(self):
+        active_version = self.redis.get(ACTIVE_VERSION_KEY)
+        building_version = update_lock_version(self.redis.get(UPDATE_LOCK_KEY))
+        versions = self.redis.zrevrange(VERSIONS_KEY, 0, -1)
+        retained = [v for v in versions if v != active_version][
+            : MANIFEST_RETAINED_VERSIONS - 1
+        ]
+
+        for version in versions:
+            if version in (active_version, building_version) or version in retained:
+                continue
+
+            for keys in batched(
+                self.redis.scan_iter(match=f"{version_prefix(version)}:*"),
+                INGEST_BATCH_SIZE,
+            ):
+                self.redis.unlink(*keys)
+            self.redis.zrem(VERSIONS_KEY, version)
+
+        self.remove_legacy_keys()
+
+    def remove_legacy_keys(self):
+        # only runs once a version has been activated, until then servers still on the old layout can read them
+        for pattern in LEGACY_KEY_PATTERNS:
+            for keys in batched(self.redis.scan_iter(match=pattern), INGEST_BATCH_SIZE):
+                self.redis.unlink(*keys)
+        self.redis.unlink(LEGACY_VERSION_KEY)
+
+    def store_table(self, version, table_name, records):
+        # each table is stored as a redis hash of definition hash -> serialized definition so that
+        # readers can fetch only the definitions they need instead of the whole table.
+        # records can be any iterable of (hash, bytes), it's written in pipelined batches
+        # so only INGEST_BATCH_SIZE * INGEST_PIPELINE_DEPTH definitions are held at once
+        key = table_key(version, table_name)
+        pipeline = self.definitions_redis.pipeline(transaction=False)
+        pipeline.delete(key)
+
+        for batch in batched(records, INGEST_BATCH_SIZE):
+            pipeline.hset(key, mapping=dict(batch))
+            if len(pipeline) >= INGEST_PIPELINE_DEPTH:
+                pipeline.execute()
+
+        pipeline.execute()
+
+    def iter_table(self, version, table_name):
+        for definition_hash, value in self.definitions_redis.hscan_iter(
+            table_key(version, table_name), count=INGEST_BATCH_SIZE
+        ):
+            yield definition_hash.decode(), value
+
+    def load(self, version, table_name, keys):
+        return self.definitions_redis.hmget(table_key(version, table_name), keys)
+
+    def load_table(self, version, table_name):
+        data = self.definitions_redis.hgetall(table_key(version, table_name))
+        return {k.decode(): v for k, v in data.items()}
+
+
+# directory the file backend keeps its manifest versions in
+MANIFEST_DIR = os.environ.get("MANIFEST_DIR", "manifest")
+
+# Table file layout, all integers little endian:
+#   header: magic, format, number of records
+#   index: an entry for every record, sorted by key
+#   format 1, tables keyed by definition hash: (hash, record offset, record length)
+#   format 2, tables with other keys: (key offset, key length, record offset, record length), the keys
+#     are packed after the index as utf-8
+#   records: the serialized definitions packed one after another
+# almost every table is keyed by hash, the few that aren't, like DestinyHistoricalStatsDefinition, use format 2
+MANIFEST_FILE_MAGIC = b"DMAM"
+HASH_KEYS_FORMAT = 1
+STRING_KEYS_FORMAT = 2
+MANIFEST_FILE_HEADER = struct.Struct("<4sII")
+MANIFEST_FILE_INDEX_ENTRIES = {
+    HASH_KEYS_FORMAT: struct.Struct("<IQI"),
+    STRING_KEYS_FORMAT: struct.Struct("<QIQI"),
+}
+MAX_DEFINITION_HASH = 2**32 - 1
+
+
+class ManifestFileError(Exception):
+    pass
+
+
+def definition_hash_key(key):
+    # the key as a definition hash, or None when it isn't one
+    if isinstance(key, int) or (key.isascii() and key.isdigit()):
+        value = int(key)
+        if value <= MAX_DEFINITION_HASH:
+            return value
+    return None
+
+
+def write_table_file(path, records):
+    # records are written to a side file first since the index has to come before them and
+    # isn't known until every record has been seen, only the index entries are kept in memory
+    records_path = f"{path}.records"
+    entries = []
+    with open(records_path, "wb") as records_file:
+        offset = 0
+        for definition_hash, value in records:
+            records_file.write(value)
+            entries.append((str(definition_hash), offset, len(value)))
+            offset += len(value)
+
+    hashes = [definition_hash_key(key) for key, _, _ in entries]
+    if all(h is not None for h in hashes):
+        file_format = HASH_KEYS_FORMAT
+        entries = sorted(
+            (h, offset, length) for h, (_, offset, length) in zip(hashes, entries)
+        )
+        keys = b""
+    else:
+        file_format = STRING_KEYS_FORMAT
+        entries = sorted(
+            (key.encode(), offset, length) for key, offset, length in entries
+        )
+        keys = b"".join(key for key, _, _ in entries)
+
+    index_entry = MANIFEST_FILE_INDEX_ENTRIES[file_format]
+    keys_start = MANIFEST_FILE_HEADER.size + len(entries) * index_entry.size
+    records_start = keys_start + len(keys)
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(
+            MANIFEST_FILE_HEADER.pack(MANIFEST_FILE_MAGIC, file_format, len(entries))
+        )
+        key_offset = keys_start
+        for key, offset, length in entries:
+            if file_format == HASH_KEYS_FORMAT:
+                f.write(index_entry.pack(key, records_start + offset, length))
+            else:
+                f.write(
+                    index_entry.pack(
+                        key_offset, len(key), records_start + offset, length
+                    )
+                )
+                key_offset += len(key)
+        f.write(keys)
+        with open(records_path, "rb") as records_file:
+            shutil.copyfileobj(records_file, f)
+
+    os.remove(records_path)
+    os.replace(temporary_path, path)
+
+
+# A memory mapped table file. Every worker on the node maps the same file so the records are shared through
+# the page cache, and a lookup is a binary search over the index followed by a slice of the mapping
+class ManifestFile:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.format, self.count = MANIFEST_FILE_HEADER.unpack_from(self.data, 0)
+        if (
+            magic != MANIFEST_FILE_MAGIC
+            or self.format not in MANIFEST_FILE_INDEX_ENTRIES
+        ):
+            raise ManifestFileError(f"{path} isn't a manifest table file")
+        self.index_entry = MANIFEST_FILE_INDEX_ENTRIES[self.format]
+
+    def entry(self, index):
+        # (key, record offset, record length), the key is an int hash or utf-8 bytes depending on the format
+        entry = self.index_entry.unpack_from(
+            self.data,
+            MANIFEST_FILE_HEADER.size + index * self.index_entry.size,
+        )
+        if self.format == HASH_KEYS_FORMAT:
+            return entry
+        key_offset, key_length, offset, length = entry
+        return self.data[key_offset : key_offset + key_length], offset, length
+
+    def find(self, key):
+        if self.format == HASH_KEYS_FORMAT:
+            key = definition_hash_key(key)
+            if key is None:
+                return None
+        else:
+            key = str(key).encode()
+
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, offset, length = self.entry(middle)
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            else:
+                return self.data[offset : offset + length]
+        return None
+
+    def __iter__(self):
+        for index in range(self.count):
+            key, offset, length = self.entry(index)
+            key = str(key) if self.format == HASH_KEYS_FORMAT else key.decode()
+            yield key, self.data[offset : offset + length]
+
+
+class FileManifestBackend:
+    def __init__(self, directory=MANIFEST_DIR):
+        self.directory = directory
+        self.files = {}
+        self.files_lock = threading.Lock()
+        self.lock_file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def version_directory(self, version):
+        return os.path.join(self.directory, version)
+
+    def table_path(self, version, table_name):
+        return os.path.join(self.version_directory(version), f"{table_name}.bin")
+
+    def get_active_version(self):
+        try:
+            with open(os.path.join(self.directory, "active")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def acquire_update_lock(self, version):
+        lock_file = open(os.path.join(self.directory, "update.lock"), "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        lock_file.truncate(0)
+        lock_file.write(version)
+        lock_file.flush()
+        self.lock_file = lock_file
+        return True
+
+    def release_update_lock(self):
+        if self.lock_file is not None:
+            self.lock_file.truncate(0)
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def register_version(self, version):
+        os.makedirs(self.version_directory(version), exist_ok=True)
+
+    def activate_version(self, version):
+        # the marker's modification time orders the versions when old ones are removed
+        with open(os.path.join(self.version_directory(version), "activated"), "w"):
+            pass
+
+        temporary_path = os.path.join(self.directory, "active.tmp")
+        with open(temporary_path, "w") as f:
+            f.write(version)
+        os.replace(temporary_path, os.path.join(self.directory, "active"))
+
+    def remove_old_versions(self):
+        active_version = self.get_active_version()
+        try:
+            with open(os.path.join(self.directory, "update.lock")) as f:
+                building_version = f.read().strip()
+        except FileNotFoundError:
+            building_version = None
+
+        def activated_at(version):
+            try:
+                return os.path.getmtime(
+                    os.path.join(self.version_directory(version), "activated")
+                )
+            except FileNotFoundError:
+                return 0
+
+        versions = sorted(
+            (
+                v
+                for v in os.listdir(self.directory)
+                if os.path.isdir(self.version_directory(v))
+            ),
+            key=activated_at,
+            reverse=True,
+        )
+        retained = [v for v in versions if v != active_version][
+            : MANIFEST_RETAINED_VERSIONS - 1
+        ]
+
+        for version in versions:
+            if version in (active_version, building_version) or version in retained:
+                continue
+            # workers that still have the files mapped keep reading them until they let go
+            shutil.rmtree(self.version_directory(version), ignore_errors=True)
+
+    def store_table(self, version, table_name, records):
+        write_table_file(self.table_path(version, table_name), records)
+
+    def open_table(self, version, table_name):
+        key = (version, table_name)
+        with self.files_lock:
+            if key not in self.files:
+                # forget the mappings of versions that aren't being read anymore
+                if all(v != version for v, _ in self.files):
+                    active_version = self.get_active_version()
+                    self.files = {
+                        k: f
+                        for k, f in self.files.items()
+                        if k[0] in (version, active_version)
+                    }
+                try:
+                    self.files[key] = ManifestFile(self.table_path(version, table_name))
+                except FileNotFoundError:
+                    self.files[key] = None
+            return self.files[key]
+
+    def iter_table(self, version, table_name):
+        table = self.open_table(version, table_name)
+        return iter(table) if table is not None else iter(())
+
+    def load(self, version, table_name, keys):
+        table = self.open_table(version, table_name)
+        if table is None:
+            return [None] * len(keys)
+        return [table.find(k) for k in keys]
+
+    def load_table(self, version, table_name):
+        return dict(self.iter_table(version, table_name))
+
+
+MANIFEST_BACKENDS = {
+    "redis": RedisManifestBackend,
+    "file": FileManifestBackend,
+}
+
+_manifest_backend = None
+
+
+def get_manifest_backend():
+    # MANIFEST_BACKEND picks where manifests are stored, redis unless it's set to file.
+    # the backend is shared by the whole process so the file backend's mappings are reused across requests
+    global _manifest_backend
+    if _manifest_backend is None:
+        _manifest_backend = MANIFEST_BACKENDS[
+            os.environ.get("MANIFEST_BACKEND", "redis")
+        ]()
+    return _manifest_backend
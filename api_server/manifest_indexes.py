@@ -0,0 +1,68 @@
+from api_server.models import (
+    INVENTORY_ITEM_TABLE,
+    SOCKET_LAYOUT_CATEGORY_HASHES,
+    SOCKET_LAYOUT_TABLE,
+    TALENT_GRID_INDEX_TABLE,
+    TALENT_GRID_TABLE,
+    build_socket_layout,
+    build_talent_grid_index,
+)
+
+
+# Indexes derived from the manifest tables. They are built from the stored tables after a manifest has been
+# ingested and saved next to them, so requests only have to merge in the live item instance data
+
+
+def iter_socket_layouts(inventory_item_def_batches, load_inventory_item_defs):
+    for inventory_item_defs in inventory_item_def_batches:
+        initial_item_hashes = [
+            item_def["sockets"]["socketEntries"][index]["singleInitialItemHash"]
+            for item_def in inventory_item_defs.values()
+            for category in item_def.get("sockets", {}).get("socketCategories", [])
+            if category["socketCategoryHash"] in SOCKET_LAYOUT_CATEGORY_HASHES
+            for index in category["socketIndexes"]
+        ]
+        initial_item_defs = load_inventory_item_defs(
+            [h for h in initial_item_hashes if str(h) not in inventory_item_defs]
+        )
+
+        def get_item_def(item_hash):
+            item_def = inventory_item_defs.get(str(item_hash))
+            return (
+                item_def
+                if item_def is not None
+                else initial_item_defs.get(str(item_hash))
+            )
+
+        for item_hash, item_def in inventory_item_defs.items():
+            layout = build_socket_layout(
+                item_def, get_item_def, SOCKET_LAYOUT_CATEGORY_HASHES
+            )
+            if layout:
+                yield item_hash, layout
+
+
+def iter_talent_grid_indexes(talent_grid_batches):
+    for talent_grids in talent_grid_batches:
+        for talent_grid_hash, talent_grid in talent_grids.items():
+            yield talent_grid_hash, build_talent_grid_index(talent_grid)
+
+
+def build_indexes(manifest, version):
+    manifest.store_definitions(
+        version,
+        SOCKET_LAYOUT_TABLE,
+        iter_socket_layouts(
+            manifest.iter_table_batches(version, INVENTORY_ITEM_TABLE),
+            lambda hashes: manifest.load_definitions(
+                version, INVENTORY_ITEM_TABLE, hashes
+            ),
+        ),
+    )
+    manifest.store_definitions(
+        version,
+        TALENT_GRID_INDEX_TABLE,
+        iter_talent_grid_indexes(
+            manifest.iter_table_batches(version, TALENT_GRID_TABLE)
+        ),
+    )
@@ -0,0 +1,124 @@
+from api_server.models import (
+    INVENTORY_ITEM_TABLE,
+    SANDBOX_PERK_TABLE,
+    TALENT_GRID_TABLE,
+)
+
+# The fields of each manifest table the server reads. Everything else is dropped when a table is stored.
+# A field maps to True to keep its whole value, or to a nested spec (a dict, or a list of field names that are
+# kept whole) to project it further. Nested specs are applied to every element when the value is a list.
+DISPLAY_PROPERTIES = ["name", "description", "icon"]
+
+MANIFEST_PROJECTIONS = {
+    INVENTORY_ITEM_TABLE: {
+        "displayProperties": DISPLAY_PROPERTIES,
+        "itemTypeDisplayName": True,
+        "inventory": ["bucketTypeHash", "tierType"],
+        "classType": True,
+        "sockets": {
+            "socketCategories": True,
+            "socketEntries": [
+                "socketTypeHash",
+                "singleInitialItemHash",
+                "reusablePlugSetHash",
+            ],
+        },
+        "investmentStats": True,
+        "perks": ["perkHash"],
+        "talentGrid": ["talentGridHash", "hudDamageType"],
+    },
+    SANDBOX_PERK_TABLE: {
+        "displayProperties": DISPLAY_PROPERTIES,
+        "isDisplayable": True,
+    },
+    TALENT_GRID_TABLE: {
+        "nodes": {
+            "nodeIndex": True,
+            "nodeHash": True,
+            "row": True,
+            "column": True,
+            "groupHash": True,
+            "nodeStyleIdentifier": True,
+            "steps": {"displayProperties": DISPLAY_PROPERTIES},
+        },
+        "nodeCategories": {
+            "nodeHashes": True,
+            "displayProperties": DISPLAY_PROPERTIES,
+        },
+    },
+    "DestinyRaceDefinition": {"genderedRaceNamesByGenderHash": True},
+    "DestinyClassDefinition": {"displayProperties": DISPLAY_PROPERTIES},
+}
+
+
+class ManifestFieldNotProjected(KeyError):
+    def __init__(self, path, field):
+        super().__init__(
+            f"{path}.{field} isn't stored in the manifest, add it to MANIFEST_PROJECTIONS"
+        )
+
+
+# a definition (or part of one) read from a projected table, looking up a field that was dropped at ingest,
+# with [] or get, raises ManifestFieldNotProjected instead of looking like the definition doesn't have it
+class ProjectedDefinition(dict):
+    __slots__ = ("path", "fields")
+
+    def __missing__(self, key):
+        if key in self.fields:
+            raise KeyError(key)
+        raise ManifestFieldNotProjected(self.path, key)
+
+    def get(self, key, default=None):
+        # the default is only for fields the projection keeps but this definition doesn't have
+        if key not in self.fields and not dict.__contains__(self, key):
+            raise ManifestFieldNotProjected(self.path, key)
+        return dict.get(self, key, default)
+
+
+def normalize_spec(spec):
+    if isinstance(spec, (list, tuple)):
+        return {field: True for field in spec}
+    return spec
+
+
+def project(value, spec):
+    if spec is True:
+        return value
+    if isinstance(value, list):
+        return [project(v, spec) for v in value]
+    if not isinstance(value, dict):
+        return value
+
+    fields = normalize_spec(spec)
+    return {k: project(v, fields[k]) for k, v in value.items() if k in fields}
+
+
+def wrap(value, spec, path):
+    if spec is True:
+        return value
+    if isinstance(value, list):
+        return [wrap(v, spec, path) for v in value]
+    if not isinstance(value, dict):
+        return value
+
+    fields = normalize_spec(spec)
+    wrapped = ProjectedDefinition(
+        (k, wrap(v, fields.get(k, True), f"{path}.{k}")) for k, v in value.items()
+    )
+    wrapped.path = path
+    wrapped.fields = fields
+    return wrapped
+
+
+def project_definition(table_name, definition):
+    spec = MANIFEST_PROJECTIONS.get(table_name)
+    if spec is None:
+        return definition
+    return project(definition, spec)
+
+
+def wrap_definition(table_name, definition):
+    spec = MANIFEST_PROJECTIONS.get(table_name)
+    if spec is None or definition is None:
+        return definition
+    return wrap(definition, spec, table_name)
@@ -0,0 +1,76 @@
+import json
+import os
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Serializers turn a single manifest definition into the bytes the manifest backend stores and back. The name of the
+# serializer a manifest was written with is part of its stored version, so readers never decode a version
+# with a different format.
+
+
+class JSONSerializer:
+    name = "json"
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class MsgpackSerializer:
+    name = "msgpack"
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class ZstdSerializer:
+    def __init__(self, serializer, level=3):
+        self.serializer = serializer
+        self.name = f"{serializer.name}+zstd"
+        self.level = level
+
+    def dumps(self, value):
+        # compressors aren't thread safe, making one per call is cheap compared to compressing
+        return zstandard.ZstdCompressor(level=self.level).compress(
+            self.serializer.dumps(value)
+        )
+
+    def loads(self, data):
+        return self.serializer.loads(zstandard.ZstdDecompressor().decompress(data))
+
+
+def get_serializer(name):
+    # name is a format optionally followed by +zstd, like msgpack+zstd. formats whose library isn't installed
+    # fall back to json so the server (and tests) keep working with only the standard library
+    format_name, _, compression = name.partition("+")
+
+    if format_name == "msgpack" and msgpack is not None:
+        serializer = MsgpackSerializer()
+    elif format_name in ("json", "msgpack"):
+        serializer = JSONSerializer()
+    else:
+        raise ValueError(f"unknown manifest serialization {name}")
+
+    if compression == "zstd" and zstandard is not None:
+        serializer = ZstdSerializer(serializer)
+    elif compression not in ("", "zstd"):
+        raise ValueError(f"unknown manifest compression {compression}")
+
+    return serializer
+
+
+manifest_serializer = get_serializer(os.environ.get("MANIFEST_SERIALIZATION", "json"))
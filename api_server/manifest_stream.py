@@ -0,0 +1,119 @@
+import codecs
+import json
+
+# size of the chunks read from the manifest download
+STREAM_CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = " \t\n\r"
+
+
+class ManifestStreamError(ValueError):
+    pass
+
+
+# Reads a JSON document made of nested objects from an iterator of byte chunks without holding the whole
+# document in memory. Only one value (a single manifest definition) is decoded at a time, the buffer is
+# trimmed as the reader moves forward so memory stays around the size of a chunk plus the largest value.
+class JSONObjectStream:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def read_more(self):
+        if self.eof:
+            return False
+
+        # drop everything that has already been parsed before growing the buffer
+        self.buffer = self.buffer[self.position :]
+        self.position = 0
+
+        for chunk in self.chunks:
+            text = self.text_decoder.decode(chunk)
+            if text:
+                self.buffer += text
+                return True
+
+        self.buffer += self.text_decoder.decode(b"", final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position] in WHITESPACE
+            ):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                raise ManifestStreamError("unexpected end of manifest")
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ManifestStreamError(
+                f"expected {character!r} but found {self.buffer[self.position]!r}"
+            )
+        self.position += 1
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # a value that runs right up to the end of the buffer might continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read_more()
+
+    def iter_object(self):
+        # yields the keys of the object at the current position and leaves the reader at each key's value,
+        # the caller has to consume the value before asking for the next key
+        self.expect("{")
+        if self.peek() == "}":
+            self.position += 1
+            return
+
+        while True:
+            key = self.decode_value()
+            if not isinstance(key, str):
+                raise ManifestStreamError("expected an object key")
+            self.expect(":")
+            yield key
+
+            separator = self.peek()
+            self.position += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ManifestStreamError(f"unexpected {separator!r} in object")
+
+
+def iter_table_definitions(stream):
+    for definition_hash in stream.iter_object():
+        yield definition_hash, stream.decode_value()
+
+
+def iter_world_tables(chunks):
+    # yields (table name, iterator of (hash, definition)) for the aggregate world content file, each table
+    # iterator has to be consumed before moving on to the next table
+    stream = JSONObjectStream(chunks)
+    for table_name in stream.iter_object():
+        definitions = iter_table_definitions(stream)
+        yield table_name, definitions
+        # skip whatever the caller didn't read so the stream is positioned at the next table
+        for _ in definitions:
+            pass
+
+
+def iter_single_table(chunks):
+    # the per table content files are a single object of hash -> definition
+    return iter_table_definitions(JSONObjectStream(chunks))
@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+import time
+
+from api_server.destiny_manifest import DestinyManifest, manifest_cache
+from api_server.models import SOCKET_LAYOUT_TABLE, TALENT_GRID_INDEX_TABLE
+
+logger = logging.getLogger(__name__)
+
+# the small tables every request reads and the indexes built at ingest. The large tables, like
+# DestinyInventoryItemDefinition, are left to the cache to fill with the definitions requests actually use,
+# loading them whole would put the entire table in every worker
+DEFAULT_WARMUP_TABLES = [
+    "DestinyRaceDefinition",
+    "DestinyClassDefinition",
+    TALENT_GRID_INDEX_TABLE,
+    SOCKET_LAYOUT_TABLE,
+]
+
+
+def configured_warmup_tables():
+    # MANIFEST_WARMUP_TABLES is a comma separated list of tables
+    value = os.environ.get("MANIFEST_WARMUP_TABLES")
+    if value is None:
+        return DEFAULT_WARMUP_TABLES
+    return [t.strip() for t in value.split(",") if t.strip()]
+
+
+MANIFEST_WARMUP_TABLES = configured_warmup_tables()
+# seconds after a failed warmup before the readiness probe starts another one
+MANIFEST_WARMUP_RETRY_INTERVAL = int(
+    os.environ.get("MANIFEST_WARMUP_RETRY_INTERVAL", 30)
+)
+
+
+# Loads whole manifest tables into the process manifest cache before requests need them, so the first requests
+# after a deploy don't all pay for the same table loads. Run before gunicorn forks its workers (preload_app),
+# the warmed cache is shared by every worker copy-on-write.
+#
+# Once the app is serving, a failed warmup is retried and a new manifest version, which empties the cache, is
+# warmed again, both on a background thread. A worker that was ready stays ready while it warms a new version so
+# a manifest update doesn't take every worker out of rotation at once.
+class ManifestWarmup:
+    def __init__(self, tables=MANIFEST_WARMUP_TABLES, cache=manifest_cache):
+        self.tables = tables
+        self.cache = cache
+        self.state = "pending"
+        self.running = False
+        self.version = None
+        self.warmed_tables = []
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state in ("ready", "off")
+
+    def start(self, mode):
+        # sync warms before returning, background on a thread while the app starts serving, off not at all
+        if mode == "sync":
+            self.run()
+        elif mode == "background":
+            self.run_in_background()
+        elif mode == "off":
+            self.state = "off"
+        else:
+            raise ValueError(f"unknown manifest warmup mode {mode}")
+
+    def run_in_background(self):
+        if not self.running:
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def version_changed(self, previous_version, version):
+        # the cache was emptied for a different manifest version
+        if self.state != "off" and previous_version is not None:
+            self.run_in_background()
+
+    def check(self):
+        # called by the readiness probe, so a worker that no requests reach still notices
+        if self.state == "off" or self.running:
+            return
+        if self.state == "failed":
+            if time.time() - self.finished_at >= MANIFEST_WARMUP_RETRY_INTERVAL:
+                self.run_in_background()
+        elif self.state == "ready":
+            if DestinyManifest(self.cache).backend.get_active_version() != self.version:
+                self.run_in_background()
+
+    def run(self, manifest=None):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+
+        manifest = manifest if manifest is not None else DestinyManifest(self.cache)
+        if self.state != "ready":
+            self.state = "running"
+        self.started_at = time.time()
+        self.finished_at = None
+
+        try:
+            version = manifest.version
+            if version is None:
+                raise RuntimeError("no manifest has been stored")
+
+            for table_name in self.tables:
+                if not manifest.get_table(table_name):
+                    # every warmed table has definitions, an empty one isn't stored in this version
+                    raise RuntimeError(f"{table_name} is empty in manifest {version}")
+
+            # a table loaded into a cache too small for it evicts itself or the ones warmed before it
+            evicted = [t for t in self.tables if not self.cache.has_table(version, t)]
+            if evicted:
+                raise RuntimeError(
+                    f"{', '.join(evicted)} didn't stay in the manifest cache, raise MANIFEST_CACHE_MAX_BYTES "
+                    "or warm fewer tables"
+                )
+
+            self.version = version
+            self.warmed_tables = list(self.tables)
+            self.error = None
+            self.state = "ready"
+        except Exception as e:
+            logger.exception("manifest warmup failed")
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            self.finished_at = time.time()
+            self.running = False
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "running": self.running,
+            "version": self.version,
+            "tables": self.warmed_tables,
+            "error": self.error,
+            "seconds": self.finished_at - self.started_at
+            if self.finished_at is not None
+            else None,
+        }
+
+
+def init_manifest_warmup(app):
+    # MANIFEST_WARMUP is sync, background or off. The flask cli creates the app to find every command, the
+    # manifest commands included, so there it's off, `flask manifest warmup` warms explicitly
+    if os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+        mode = "off"
+    else:
+        mode = os.environ.get("MANIFEST_WARMUP", "sync")
+    app.config.setdefault("MANIFEST_WARMUP", mode)
+    warmup = app.extensions["manifest_warmup"] = ManifestWarmup()
+    warmup.start(app.config["MANIFEST_WARMUP"])
+    warmup.cache.version_listeners.append(warmup.version_changed)
+    return warmup
@@ -0,0 +1,174 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from api_server.models import EnergyType
+
+# Answers "which of these armor pieces can fit this set of mods" for many mod sets at once. The armor is packed
+# into columns once, a row per piece, and every mod set is checked against every piece with array operations
+# instead of a loop per piece and mod.
+#
+# A mod set fits a piece when
+#   - every mod with an energy type has the piece's energy type, pieces without an energy type take any mod
+#   - the piece has at least as many mod slots of each socket type as the set has mods for it
+#   - the mods' energy costs fit in the piece's free energy. When the mods replace the ones already socketed,
+#     the mods in the slots they take count as free, the most expensive ones are assumed to be replaced
+# The armor's energy type and capacity are taken as they are, changing or upgrading them isn't considered.
+
+# mod sets are evaluated this many (mod set, piece, socket type) cells at a time to bound the memory used
+MOD_FIT_CHUNK_CELLS = 4 * 1024 * 1024
+
+# energy type of a mod set whose mods need different energy types, no piece has it
+MIXED_ENERGY_TYPE = -1
+
+
+@dataclass
+class Mod:
+    __slots__ = ("socket_type", "energy_type", "energy_cost")
+
+    socket_type: int
+    energy_type: EnergyType
+    energy_cost: int
+
+    @classmethod
+    def from_json(self, response):
+        return Mod(
+            socket_type=int(response["socketType"]),
+            energy_type=EnergyType(response.get("energyType") or EnergyType.Any),
+            energy_cost=int(response.get("energyCost") or 0),
+        )
+
+
+def plug_energy_cost(socket):
+    if socket.current_plug is None or socket.current_plug.energy_cost is None:
+        return 0
+    return socket.current_plug.energy_cost
+
+
+class ArmorColumns:
+    def __init__(self, pieces):
+        self.item_instance_ids = [p.item_instance_id for p in pieces]
+
+        socket_types = sorted({int(s.socket_type) for p in pieces for s in p.mod_slots})
+        # the last column is for socket types none of the pieces have, every piece has 0 slots of it
+        self.socket_type_columns = {t: i for i, t in enumerate(socket_types)}
+        columns = len(socket_types) + 1
+
+        self.energy_type = np.array([p.energy_type for p in pieces], dtype=np.int8)
+        self.free_energy = np.array(
+            [p.energy_capacity - p.energy_used for p in pieces], dtype=np.int16
+        )
+        # one entry per mod slot of every piece, slots are then counted and sorted with array operations
+        rows = []
+        socket_columns = []
+        empty = []
+        costs = []
+        for row, piece in enumerate(pieces):
+            for socket in piece.mod_slots:
+                rows.append(row)
+                socket_columns.append(self.socket_type_columns[int(socket.socket_type)])
+                empty.append(socket.current_plug is None)
+                costs.append(plug_energy_cost(socket))
+        rows = np.array(rows, dtype=np.intp)
+        socket_columns = np.array(socket_columns, dtype=np.intp)
+        empty = np.array(empty, dtype=bool)
+        costs = np.array(costs, dtype=np.int16)
+
+        self.slots = np.zeros((len(pieces), columns), dtype=np.int8)
+        np.add.at(self.slots, (rows, socket_columns), 1)
+        self.empty_slots = np.zeros((len(pieces), columns), dtype=np.int8)
+        np.add.at(self.empty_slots, (rows[empty], socket_columns[empty]), 1)
+
+        # freed_energy[piece, column, n] is the energy freed by replacing the n most expensive mods in the
+        # piece's slots of that socket type. The slots are sorted by piece, socket type and cost, most expensive
+        # first, so a slot's rank among the piece's slots of its type is its distance from the first one
+        order = np.lexsort((-costs, socket_columns, rows))
+        rows = rows[order]
+        socket_columns = socket_columns[order]
+        positions = np.arange(len(order))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (
+            socket_columns[1:] != socket_columns[:-1]
+        )
+        ranks = positions - np.maximum.accumulate(np.where(first, positions, 0))
+
+        self.freed_energy = np.zeros(
+            (len(pieces), columns, self.slots.max(initial=0) + 1), dtype=np.int16
+        )
+        self.freed_energy[rows, socket_columns, ranks + 1] = costs[order]
+        np.cumsum(self.freed_energy, axis=2, out=self.freed_energy)
+
+    def __len__(self):
+        return len(self.item_instance_ids)
+
+    def pack_mod_sets(self, mod_sets):
+        # mod sets as columns: mods per socket type, total energy cost and the energy type they need
+        counts = np.zeros((len(mod_sets), self.slots.shape[1]), dtype=np.int16)
+        cost = np.zeros(len(mod_sets), dtype=np.int32)
+        energy_type = np.zeros(len(mod_sets), dtype=np.int8)
+
+        unknown_column = self.slots.shape[1] - 1
+        for row, mods in enumerate(mod_sets):
+            energy_types = set()
+            for mod in mods:
+                counts[
+                    row, self.socket_type_columns.get(mod.socket_type, unknown_column)
+                ] += 1
+                cost[row] += mod.energy_cost
+                if mod.energy_type != EnergyType.Any:
+                    energy_types.add(mod.energy_type)
+            if len(energy_types) > 1:
+                energy_type[row] = MIXED_ENERGY_TYPE
+            elif energy_types:
+                energy_type[row] = energy_types.pop()
+
+        return counts, cost, energy_type
+
+    def fits(self, mod_sets, replace=True):
+        # returns a (mod set, piece) array of whether each mod set fits each piece
+        counts, cost, energy_type = self.pack_mod_sets(mod_sets)
+        result = np.zeros((len(mod_sets), len(self)), dtype=bool)
+
+        columns = self.slots.shape[1]
+        chunk = max(1, MOD_FIT_CHUNK_CELLS // max(1, len(self) * columns))
+        for start in range(0, len(mod_sets), chunk):
+            end = start + chunk
+            result[start:end] = self.fits_chunk(
+                counts[start:end], cost[start:end], energy_type[start:end], replace
+            )
+
+        return result
+
+    def fits_chunk(self, counts, cost, energy_type, replace):
+        set_energy_type = energy_type[:, None]
+        piece_energy_type = self.energy_type[None, :]
+        energy_fits = (set_energy_type == EnergyType.Any) | (
+            (set_energy_type != MIXED_ENERGY_TYPE)
+            & (
+                (set_energy_type == piece_energy_type)
+                | (piece_energy_type == EnergyType.Any)
+            )
+        )
+
+        available_slots = self.slots if replace else self.empty_slots
+        slots_fit = np.all(counts[:, None, :] <= available_slots[None, :, :], axis=2)
+
+        free_energy = self.free_energy[None, :]
+        if replace:
+            # slots_fit already rules out sets with more mods than slots, so clipping only keeps the index in range
+            replaced = np.minimum(counts, self.freed_energy.shape[2] - 1)
+            freed = self.freed_energy[
+                np.arange(len(self))[None, :, None],
+                np.arange(self.slots.shape[1])[None, None, :],
+                replaced[:, None, :],
+            ].sum(axis=2, dtype=np.int16)
+            free_energy = free_energy + freed
+        cost_fits = cost[:, None] <= free_energy
+
+        return energy_fits & slots_fit & cost_fits
+
+    def fitting_item_instance_ids(self, mod_sets, replace=True):
+        fits = self.fits(mod_sets, replace)
+        return [
+            [self.item_instance_ids[i] for i in np.flatnonzero(row)] for row in fits
+        ]
@@ -1,3 +1,4 @@
+import sys
 from abc import ABC, abstractproperty
 from dataclasses import dataclass
 from enum import Enum
@@ -10,11 +11,10 @@ from marshmallow import Schema, fields
 from marshmallow_enum import EnumField
 from marshmallow_oneofschema import OneOfSchema
 
-from api_server.destiny_manifest import DestinyManifest
-
 
 def full_icon_path(path):
-    return f"https://bungie.net{path}"
+    # the same few hundred icons show up on every loadout, interning keeps one copy of each url per process
+    return sys.intern(f"https://bungie.net{path}")
 
 
 def camelcase(s):
@@ -36,6 +36,8 @@ class JSONSchema(Schema):
 
 @dataclass
 class User:
+    __slots__ = ("destiny_membership_type", "destiny_membership_id", "display_name")
+
     destiny_membership_type: int
     destiny_membership_id: int
     display_name: str
@@ -70,6 +72,16 @@ class UserSchema(JSONSchema):
 
 @dataclass
 class Character:
+    __slots__ = (
+        "character_id",
+        "character_class",
+        "gender_and_race_description",
+        "date_last_played",
+        "light",
+        "emblem_path",
+        "emblem_background_path",
+    )
+
     character_id: str
     character_class: str
     gender_and_race_description: str
@@ -137,6 +149,18 @@ class DamageType(int, Enum):
     Stasis = 6
 
 
+class ArmorStat(int, Enum):
+    Mobility = 2996146975
+    Resilience = 392767087
+    Recovery = 1943323491
+    Discipline = 1735777505
+    Intellect = 144602215
+    Strength = 4244567218
+
+
+# inventory.tierType of exotic items, a loadout can only have one exotic armor piece
+EXOTIC_TIER_TYPE = 6
+
 BUCKET_HASH_ARMOR_TYPE_MAPPING = {
     3448274439: ArmorType.Helmet,
     3551918588: ArmorType.Arms,
@@ -159,6 +183,8 @@ STAT_TYPE_HASH_ENERGY_TYPE_MAPPING = {
 
 @dataclass
 class PerkResponse:
+    __slots__ = ("hash", "description")
+
     hash: str
     description: str
 
@@ -172,6 +198,15 @@ class PerkResponseSchema(JSONSchema):
 # or transformed into somethng else if more custom fields are needed
 @dataclass
 class PlugResponse:
+    __slots__ = (
+        "plug_hash",
+        "display_name",
+        "icon_path",
+        "energy_type",
+        "energy_cost",
+        "perks",
+    )
+
     plug_hash: str
     display_name: str
     icon_path: str
@@ -191,6 +226,15 @@ class PlugResponseSchema(JSONSchema):
 
 @dataclass
 class SocketResponse:
+    __slots__ = (
+        "display_name",
+        "socket_type",
+        "icon_path",
+        "plug_set_hash",
+        "initial_item_hash",
+        "current_plug",
+    )
+
     display_name: str
     socket_type: str
     icon_path: str
@@ -208,119 +252,208 @@ class SocketResponseSchema(JSONSchema):
     current_plug = fields.Nested(PlugResponseSchema)
 
 
+INVENTORY_ITEM_TABLE = "DestinyInventoryItemDefinition"
+SANDBOX_PERK_TABLE = "DestinySandboxPerkDefinition"
+TALENT_GRID_TABLE = "DestinyTalentGridDefinition"
+
+
+SOCKET_LAYOUT_TABLE = "SocketLayout"
+TALENT_GRID_INDEX_TABLE = "TalentGridIndex"
+
+
+def build_socket_layout(item_def, get_item_def, socket_category_hashes):
+    # the static part of an item's sockets, category hash -> the sockets in that category with the display data
+    # of their initial plug. it only depends on the manifest so it's built once when the manifest is stored
+    layout = {}
+    for category in item_def.get("sockets", {}).get("socketCategories", []):
+        if category["socketCategoryHash"] not in socket_category_hashes:
+            continue
+
+        category_layout = []
+        for index in category["socketIndexes"]:
+            item_def_socket_entry = item_def["sockets"]["socketEntries"][index]
+            socket_initial_item_def = get_item_def(
+                item_def_socket_entry["singleInitialItemHash"]
+            )
+            if socket_initial_item_def is None:
+                # For some reason the melee ability in void 3.0 subclasses doesn't exist in item defs
+                socket_initial_item_def = {
+                    "itemTypeDisplayName": "",
+                    "displayProperties": {"icon": ""},
+                }
+
+            category_layout.append(
+                {
+                    "socketIndex": index,
+                    "socketTypeHash": item_def_socket_entry["socketTypeHash"],
+                    "plugSetHash": item_def_socket_entry.get("reusablePlugSetHash"),
+                    "initialItemHash": item_def_socket_entry["singleInitialItemHash"],
+                    "displayName": socket_initial_item_def["itemTypeDisplayName"],
+                    "iconPath": full_icon_path(
+                        socket_initial_item_def["displayProperties"]["icon"]
+                    ),
+                }
+            )
+        layout[str(category["socketCategoryHash"])] = category_layout
+    return layout
+
+
+def get_socket_layout(resolver, item_hash, socket_category_hashes):
+    layout = resolver.get(SOCKET_LAYOUT_TABLE, item_hash)
+    if layout is None:
+        # manifests stored before socket layouts existed don't have the index, so build it from the definitions
+        layout = build_socket_layout(
+            resolver.get(INVENTORY_ITEM_TABLE, item_hash),
+            lambda h: resolver.get(INVENTORY_ITEM_TABLE, h),
+            socket_category_hashes,
+        )
+    return layout
+
+
+def prefetch_socket_definitions(resolver, socketed_items, item_hashes=()):
+    # socketed_items is a list of (SocketedItem class, item hash, item instance socket response).
+    # Every definition the sockets of all the items reference is loaded with one lookup per table and level,
+    # so parse_sockets never has to go back to the manifest for a single item.
+    # item_hashes are other items needed by the request that can be loaded in the same first batch
+    socketed_item_hashes = [item_hash for _, item_hash, _ in socketed_items]
+    resolver.load(INVENTORY_ITEM_TABLE, socketed_item_hashes + list(item_hashes))
+    resolver.load(SOCKET_LAYOUT_TABLE, socketed_item_hashes)
+
+    plug_hashes = []
+    referenced_item_hashes = []
+    for item_class, item_hash, socket_response in socketed_items:
+        layout = resolver.get(SOCKET_LAYOUT_TABLE, item_hash)
+        if layout is None:
+            item_def = resolver.get(INVENTORY_ITEM_TABLE, item_hash)
+            socket_indexes = [
+                index
+                for category in item_def["sockets"]["socketCategories"]
+                if category["socketCategoryHash"] in item_class.socket_category_hashes
+                for index in category["socketIndexes"]
+            ]
+            referenced_item_hashes += [
+                item_def["sockets"]["socketEntries"][index]["singleInitialItemHash"]
+                for index in socket_indexes
+            ]
+        else:
+            socket_indexes = [
+                entry["socketIndex"]
+                for category_hash in item_class.socket_category_hashes
+                for entry in layout.get(str(category_hash), [])
+            ]
+
+        for index in socket_indexes:
+            if "plugHash" in socket_response[index]:
+                plug_hashes.append(socket_response[index]["plugHash"])
+
+    resolver.load(INVENTORY_ITEM_TABLE, referenced_item_hashes + plug_hashes)
+
+    resolver.load(
+        SANDBOX_PERK_TABLE,
+        [
+            perk["perkHash"]
+            for plug_hash in plug_hashes
+            for perk in resolver.get(INVENTORY_ITEM_TABLE, plug_hash)["perks"]
+        ],
+    )
+
+
 class SocketedItem(ABC):
+    __slots__ = ()
+
     @abstractproperty
     @property
     def socket_category_hashes(self):
         pass
 
     def parse_sockets(
-        self, item_hash, item_instance_socket_response, inventory_item_defs
+        self, item_hash, item_instance_socket_response, resolver
     ) -> List[SocketResponse]:
-        item_def = inventory_item_defs[str(item_hash)]
+        layout = get_socket_layout(resolver, item_hash, self.socket_category_hashes)
+
         sockets = {}
         for category_hash in self.socket_category_hashes:
-            socket_indexes = []
             category_sockets = []
-            for category in item_def["sockets"]["socketCategories"]:
-                if category["socketCategoryHash"] == category_hash:
-                    socket_indexes = category["socketIndexes"]
-
-                    for index in socket_indexes:
-                        item_def_socket_entry = item_def["sockets"]["socketEntries"][
-                            index
-                        ]
-                        item_instance_socket = item_instance_socket_response[index]
-                        socket_intitial_item_def_hash = item_def_socket_entry[
-                            "singleInitialItemHash"
-                        ]
+            for layout_entry in layout.get(str(category_hash), []):
+                item_instance_socket = item_instance_socket_response[
+                    layout_entry["socketIndex"]
+                ]
+
+                s = SocketResponse(
+                    display_name=layout_entry["displayName"],
+                    socket_type=layout_entry["socketTypeHash"],
+                    icon_path=layout_entry["iconPath"],
+                    plug_set_hash=layout_entry["plugSetHash"],
+                    initial_item_hash=layout_entry["initialItemHash"],
+                    current_plug=None,
+                )
 
-                        try:
-                            socket_initial_item_def = inventory_item_defs[
-                                str(socket_intitial_item_def_hash)
-                            ]
-                        except:
-                            # For some reason the melee ability in void 3.0 subclasses doesn't exist in item defs and will throw
-                            socket_initial_item_def = {
-                                "itemTypeDisplayName": "",
-                                "displayProperties": {"icon": ""},
-                            }
-
-                        s = SocketResponse(
-                            display_name=socket_initial_item_def["itemTypeDisplayName"],
-                            socket_type=item_def_socket_entry["socketTypeHash"],
-                            icon_path=full_icon_path(
-                                socket_initial_item_def["displayProperties"]["icon"]
-                            ),
-                            plug_set_hash=item_def_socket_entry.get(
-                                "reusablePlugSetHash"
-                            ),
-                            initial_item_hash=item_def_socket_entry[
-                                "singleInitialItemHash"
-                            ],
-                            current_plug=None,
-                        )
-
-                        # need to get the current plug info always because the aspect subclasses have sockets for jump/super/etc that have
-                        # initial items that are actual values instead of empty values. can change currentPlug to null further down the line
-                        # depending on if you need to or not
-                        if "plugHash" in item_instance_socket:
-                            active_plug_item_def = inventory_item_defs[
-                                str(item_instance_socket["plugHash"])
-                            ]
-                            energy_stat = (
-                                [
-                                    s
-                                    for s in active_plug_item_def["investmentStats"]
-                                    if s["statTypeHash"]
-                                    in STAT_TYPE_HASH_ENERGY_TYPE_MAPPING.keys()
-                                ][0]
-                                if active_plug_item_def["investmentStats"]
-                                and len(active_plug_item_def["investmentStats"]) > 0
-                                else None
-                            )
-                            sandbox_perk_defs = DestinyManifest().get_table(
-                                "DestinySandboxPerkDefinition"
-                            )
-                            perks = []
-                            for perk in active_plug_item_def["perks"]:
-                                perk_def = sandbox_perk_defs[str(perk["perkHash"])]
-                                if perk_def["isDisplayable"]:
-                                    perks.append(
-                                        PerkResponse(
-                                            hash=perk["perkHash"],
-                                            description=perk_def["displayProperties"][
-                                                "description"
-                                            ],
-                                        )
-                                    )
-
-                            s.current_plug = PlugResponse(
-                                plug_hash=item_instance_socket["plugHash"],
-                                display_name=active_plug_item_def["displayProperties"][
-                                    "name"
-                                ],
-                                icon_path=full_icon_path(
-                                    active_plug_item_def["displayProperties"]["icon"]
-                                ),
-                                energy_cost=energy_stat["value"]
-                                if energy_stat
-                                else None,
-                                energy_type=STAT_TYPE_HASH_ENERGY_TYPE_MAPPING[
-                                    energy_stat["statTypeHash"]
-                                ]
-                                if energy_stat
-                                else None,
-                                perks=perks,
+                # need to get the current plug info always because the aspect subclasses have sockets for jump/super/etc that have
+                # initial items that are actual values instead of empty values. can change currentPlug to null further down the line
+                # depending on if you need to or not
+                if "plugHash" in item_instance_socket:
+                    active_plug_item_def = resolver.get(
+                        INVENTORY_ITEM_TABLE, item_instance_socket["plugHash"]
+                    )
+                    energy_stat = (
+                        [
+                            s
+                            for s in active_plug_item_def["investmentStats"]
+                            if s["statTypeHash"]
+                            in STAT_TYPE_HASH_ENERGY_TYPE_MAPPING.keys()
+                        ][0]
+                        if active_plug_item_def["investmentStats"]
+                        and len(active_plug_item_def["investmentStats"]) > 0
+                        else None
+                    )
+                    perks = []
+                    for perk in active_plug_item_def["perks"]:
+                        perk_def = resolver.get(SANDBOX_PERK_TABLE, perk["perkHash"])
+                        if perk_def["isDisplayable"]:
+                            perks.append(
+                                PerkResponse(
+                                    hash=perk["perkHash"],
+                                    description=perk_def["displayProperties"][
+                                        "description"
+                                    ],
+                                )
                             )
 
-                        category_sockets.append(s)
+                    s.current_plug = PlugResponse(
+                        plug_hash=item_instance_socket["plugHash"],
+                        display_name=active_plug_item_def["displayProperties"]["name"],
+                        icon_path=full_icon_path(
+                            active_plug_item_def["displayProperties"]["icon"]
+                        ),
+                        energy_cost=energy_stat["value"] if energy_stat else None,
+                        energy_type=STAT_TYPE_HASH_ENERGY_TYPE_MAPPING[
+                            energy_stat["statTypeHash"]
+                        ]
+                        if energy_stat
+                        else None,
+                        perks=perks,
+                    )
+
+                category_sockets.append(s)
             sockets[category_hash] = category_sockets
         return sockets
 
 
 @dataclass
 class ArmorPiece(SocketedItem):
+    __slots__ = (
+        "item_hash",
+        "item_instance_id",
+        "item_type",
+        "bucket_hash",
+        "name",
+        "icon_path",
+        "energy_type",
+        "energy_capacity",
+        "energy_used",
+        "mod_slots",
+    )
+
     item_hash: int
     item_instance_id: str
     item_type: ArmorType
@@ -335,13 +468,13 @@ class ArmorPiece(SocketedItem):
     socket_category_hashes = [ARMOR_MOD_CATEGORY]
 
     @classmethod
-    def from_json(self, response, instance, socket_response, inventory_item_defs):
-        item = inventory_item_defs[str(response["itemHash"])]
+    def from_json(self, response, instance, socket_response, resolver):
+        item = resolver.get(INVENTORY_ITEM_TABLE, response["itemHash"])
         sockets = self.parse_sockets(
             self,
             response["itemHash"],
             socket_response,
-            inventory_item_defs,
+            resolver,
         )
 
         armor_mods = sockets[ARMOR_MOD_CATEGORY]
@@ -356,7 +489,7 @@ class ArmorPiece(SocketedItem):
             item_type=BUCKET_HASH_ARMOR_TYPE_MAPPING.get(response["bucketHash"]),
             bucket_hash=response["bucketHash"],
             name=item["displayProperties"]["name"],
-            icon_path=f'https://bungie.net{item["displayProperties"]["icon"]}',
+            icon_path=full_icon_path(item["displayProperties"]["icon"]),
             energy_type=EnergyType(instance["energy"]["energyType"]),
             energy_capacity=instance["energy"]["energyCapacity"],
             energy_used=instance["energy"]["energyUsed"],
@@ -379,6 +512,8 @@ class ArmorPieceSchema(JSONSchema):
 
 @dataclass
 class TreeStyleSubclassPerk:
+    __slots__ = ("display_name", "icon_path", "description")
+
     display_name: str
     icon_path: str
     description: str
@@ -398,6 +533,16 @@ class TreePathType(int, Enum):
 
 @dataclass
 class TreeStyleSubclassTree:
+    __slots__ = (
+        "name",
+        "icon_path",
+        "tree_path_type",
+        "left_perk",
+        "top_perk",
+        "right_perk",
+        "bottom_perk",
+    )
+
     name: str
     icon_path: str
     tree_path_type: TreePathType
@@ -426,8 +571,59 @@ MIDDLE_TREE_GROUP_HASH = 1350529727
 BOTTOM_TREE_GROUP_HASH = 1350529724
 
 
+def build_talent_grid_index(talent_grid):
+    # lookups into a talent grid for TreeStyleSubclass: nodeIndex -> node for the nodes shown on the grid,
+    # groupHash -> the nodeIndexes in that group and nodeHash -> the index of its node category.
+    # like socket layouts it only depends on the manifest so it's built once when the manifest is stored
+    nodes = {}
+    groups = {}
+    for node in talent_grid["nodes"]:
+        if node["row"] < 0 or node["column"] < 0:
+            continue
+        nodes[str(node["nodeIndex"])] = node
+        if node.get("groupHash") is not None:
+            groups.setdefault(str(node["groupHash"]), []).append(node["nodeIndex"])
+
+    category_indexes = {}
+    for index, category in enumerate(talent_grid["nodeCategories"]):
+        for node_hash in category["nodeHashes"]:
+            category_indexes.setdefault(str(node_hash), index)
+
+    return {
+        "nodes": nodes,
+        "groups": groups,
+        "categoryIndexes": category_indexes,
+        "categories": [
+            {"displayProperties": c["displayProperties"]}
+            for c in talent_grid["nodeCategories"]
+        ],
+    }
+
+
+def get_talent_grid_index(resolver, talent_grid_hash):
+    index = resolver.get(TALENT_GRID_INDEX_TABLE, talent_grid_hash)
+    if index is None:
+        # manifests stored before talent grid indexes existed don't have them, so build it from the definition
+        index = build_talent_grid_index(
+            resolver.get(TALENT_GRID_TABLE, talent_grid_hash)
+        )
+    return index
+
+
 @dataclass
 class TreeStyleSubclass:
+    __slots__ = (
+        "name",
+        "icon_path",
+        "damage_type",
+        "item_hash",
+        "active_class_ability",
+        "active_movement_ability",
+        "active_grenade_ability",
+        "active_super_ability",
+        "active_tree",
+    )
+
     name: str
     icon_path: str
     damage_type: DamageType
@@ -443,48 +639,43 @@ class TreeStyleSubclass:
         self,
         response,
         talent_grid_response,
-        inventory_item_defs,
-        talent_grid_defs,
+        resolver,
     ):
-        item_def = inventory_item_defs[str(response["itemHash"])]
-        talent_grid = talent_grid_defs[str(item_def["talentGrid"]["talentGridHash"])]
+        item_def = resolver.get(INVENTORY_ITEM_TABLE, response["itemHash"])
+        talent_grid_index = get_talent_grid_index(
+            resolver, item_def["talentGrid"]["talentGridHash"]
+        )
+        nodes = talent_grid_index["nodes"]
 
-        active_instance_nodes = [
+        active_node_indexes = {
             n["nodeIndex"] for n in talent_grid_response["nodes"] if n["isActivated"]
-        ]
-        talent_grid_nodes = [
-            n
-            for n in talent_grid["nodes"]
-            if n["nodeIndex"] in active_instance_nodes
-            and (n["row"] >= 0 and n["column"] >= 0)
-        ]
+        }
 
-        class_ability_node = [
-            n
-            for n in talent_grid_nodes
-            if n.get("groupHash") in CLASS_ABILITY_GROUP_HASHES
-        ][0]
+        def get_active_group_nodes(group_hashes):
+            return [
+                nodes[str(node_index)]
+                for group_hash in group_hashes
+                for node_index in talent_grid_index["groups"].get(str(group_hash), [])
+                if node_index in active_node_indexes
+            ]
 
-        movement_ability_node = [
-            n for n in talent_grid_nodes if n.get("groupHash") in MOVEMENT_GROUP_HASHES
-        ][0]
+        class_ability_node = get_active_group_nodes(CLASS_ABILITY_GROUP_HASHES)[0]
 
-        grenade_ability_node = [
-            n for n in talent_grid_nodes if n.get("groupHash") in GRENADE_GROUP_HASHES
-        ][0]
+        movement_ability_node = get_active_group_nodes(MOVEMENT_GROUP_HASHES)[0]
+
+        grenade_ability_node = get_active_group_nodes(GRENADE_GROUP_HASHES)[0]
 
         super_ability_node = [
-            n
-            for n in talent_grid_nodes
-            if n.get("nodeStyleIdentifier") == "specialization_super"
+            nodes[str(node_index)]
+            for node_index in sorted(active_node_indexes)
+            if str(node_index) in nodes
+            and nodes[str(node_index)].get("nodeStyleIdentifier")
+            == "specialization_super"
         ][0]
 
-        active_tree_nodes = [
-            n
-            for n in talent_grid_nodes
-            if n.get("groupHash")
-            in [TOP_TREE_GROUP_HASH, MIDDLE_TREE_GROUP_HASH, BOTTOM_TREE_GROUP_HASH]
-        ]
+        active_tree_nodes = get_active_group_nodes(
+            [TOP_TREE_GROUP_HASH, MIDDLE_TREE_GROUP_HASH, BOTTOM_TREE_GROUP_HASH]
+        )
 
         def get_step_display_properties(node):
             return node["steps"][0]["displayProperties"]
@@ -528,11 +719,9 @@ class TreeStyleSubclass:
         # find the group that the active nodes are in to get the path name without pulling the lore definition
         # all the active nodes in the tree must belong to the same group because the game enforces that, so just use the first node
 
-        tree_node_category = [
-            c
-            for c in talent_grid["nodeCategories"]
-            if active_tree_nodes[0]["nodeHash"] in c["nodeHashes"]
-        ][0]
+        tree_node_category = talent_grid_index["categories"][
+            talent_grid_index["categoryIndexes"][str(active_tree_nodes[0]["nodeHash"])]
+        ]
 
         get_node_column = lambda n: n["column"]
 
@@ -642,6 +831,8 @@ FRAGMENTS_SOCKET_CATEGORY = 1313488945
 
 @dataclass
 class AspectSubclassAbility:
+    __slots__ = ("plug_hash", "display_name", "icon_path", "description")
+
     plug_hash: str
     display_name: str
     icon_path: str
@@ -657,6 +848,8 @@ class AspectSubclassAbilitySchema(JSONSchema):
 
 @dataclass
 class AspectSubclassAspect:
+    __slots__ = ("plug_hash", "display_name", "icon_path", "fragment_slots", "perks")
+
     plug_hash: str
     display_name: str
     icon_path: str
@@ -674,6 +867,8 @@ class AspectSubclassAspectSchema(JSONSchema):
 
 @dataclass
 class AspectSubclassAspectSocket:
+    __slots__ = ("display_name", "icon_path", "current_aspect")
+
     display_name: str
     icon_path: str
     current_aspect: Optional[AspectSubclassAspect]
@@ -687,6 +882,8 @@ class AspectSubclassAspectSocketSchema(JSONSchema):
 
 @dataclass
 class AspectSubclassFragment:
+    __slots__ = ("plug_hash", "display_name", "icon_path", "perks")
+
     plug_hash: str
     display_name: str
     icon_path: str
@@ -702,6 +899,8 @@ class AspectSubclassFragmentSchema(JSONSchema):
 
 @dataclass
 class AspectSubclassFragmentSocket:
+    __slots__ = ("display_name", "icon_path", "current_fragment")
+
     display_name: str
     icon_path: str
     current_fragment: Optional[AspectSubclassFragment]
@@ -715,6 +914,20 @@ class AspectSubclassFragmentSocketSchema(JSONSchema):
 
 @dataclass
 class AspectSubclass(SocketedItem):
+    __slots__ = (
+        "name",
+        "icon_path",
+        "damage_type",
+        "item_hash",
+        "active_class_ability",
+        "active_movement_ability",
+        "active_melee_ability",
+        "active_grenade_ability",
+        "active_super_ability",
+        "aspects",
+        "fragments",
+    )
+
     name: str
     icon_path: str
     damage_type: DamageType
@@ -736,15 +949,15 @@ class AspectSubclass(SocketedItem):
     ]
 
     @classmethod
-    def from_json(self, response, socket_response, inventory_item_defs):
-        item = inventory_item_defs[str(response["itemHash"])]
+    def from_json(self, response, socket_response, resolver):
+        item = resolver.get(INVENTORY_ITEM_TABLE, response["itemHash"])
         parsed_sockets = self.parse_sockets(
-            self, response["itemHash"], socket_response, inventory_item_defs
+            self, response["itemHash"], socket_response, resolver
         )
 
         def socket_to_ability(socket):
             plug_hash = socket.current_plug.plug_hash
-            ability_item_def = inventory_item_defs[str(plug_hash)]
+            ability_item_def = resolver.get(INVENTORY_ITEM_TABLE, plug_hash)
             return AspectSubclassAbility(
                 plug_hash=plug_hash,
                 display_name=socket.current_plug.display_name,
@@ -863,6 +1076,12 @@ class AspectSubclassSchema(JSONSchema):
     fragments = fields.List(fields.Nested(AspectSubclassFragmentSocketSchema))
 
 
+# every socket category the socketed items parse, only these are kept in the socket layout index
+SOCKET_LAYOUT_CATEGORY_HASHES = (
+    ArmorPiece.socket_category_hashes + AspectSubclass.socket_category_hashes
+)
+
+
 class SubclassSchema(OneOfSchema):
     type_schemas = {
         "TreeStyleSubclass": TreeStyleSubclassSchema,
@@ -872,6 +1091,8 @@ class SubclassSchema(OneOfSchema):
 
 @dataclass
 class FullCharacterData:
+    __slots__ = ("character", "armor", "subclass")
+
     character: Character
     armor: List[ArmorPiece]
     subclass: Union[TreeStyleSubclass, AspectSubclass]
@@ -881,3 +1102,23 @@ class FullCharacterDataSchema(JSONSchema):
     character = fields.Nested(CharacterSchema)
     armor = fields.List(fields.Nested(ArmorPieceSchema))
     subclass = fields.Nested(SubclassSchema)
+
+
+@dataclass
+class Loadout:
+    __slots__ = ("armor", "stats", "tiers", "complete", "searched")
+
+    armor: List[ArmorPiece]
+    stats: Dict[str, int]
+    tiers: int
+    # False when the search ran out of time, the loadout is then the best one found before that
+    complete: bool
+    searched: int
+
+
+class LoadoutSchema(JSONSchema):
+    armor = fields.List(fields.Nested(ArmorPieceSchema))
+    stats = fields.Dict(keys=fields.Str(), values=fields.Int())
+    tiers = fields.Int()
+    complete = fields.Bool()
+    searched = fields.Int()
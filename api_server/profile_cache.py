@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+import time
+
+from api_server.redis_client import get_redis
+
+# profile responses younger than this are served from the cache without asking Bungie
+PROFILE_CACHE_TTL = int(os.environ.get("PROFILE_CACHE_TTL", 30))
+# for this long after that they're still served, but refreshed in the background. 0 always waits for Bungie
+PROFILE_CACHE_STALE_TTL = int(os.environ.get("PROFILE_CACHE_STALE_TTL", 300))
+
+
+def membership_key(membership_type, membership_id):
+    return f"profile:{membership_type}:{membership_id}"
+
+
+# Caches Bungie profile responses in redis per membership and request url, and so per character and set of
+# components. Entries past PROFILE_CACHE_TTL are served stale while one worker refreshes them, and all of a
+# membership's entries can be dropped after something changes their loadout.
+class ProfileCache:
+    def __init__(self, ttl=PROFILE_CACHE_TTL, stale_ttl=PROFILE_CACHE_STALE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.upstream_requests = 0
+        self.upstream_seconds = 0.0
+        self.saved_seconds = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def redis(self):
+        return get_redis()
+
+    def get(self, membership_type, membership_id, url, fetch):
+        # fetch() requests url from Bungie and returns the decoded response.
+        # it may be called from a background thread so it can't rely on the flask request context
+        if self.ttl <= 0:
+            return self.fetch(fetch)[0]
+
+        key = f"{membership_key(membership_type, membership_id)}:{url}"
+        cached = self.redis.get(key)
+
+        if cached is not None:
+            entry = json.loads(cached)
+            age = time.time() - entry["fetchedAt"]
+            with self.lock:
+                self.saved_seconds += entry["latency"]
+                if age < self.ttl:
+                    self.hits += 1
+                else:
+                    self.stale_hits += 1
+
+            if age >= self.ttl:
+                self.refresh_in_background(membership_type, membership_id, key, fetch)
+
+            return entry["response"]
+
+        with self.lock:
+            self.misses += 1
+
+        response, latency = self.fetch(fetch)
+        self.store(membership_type, membership_id, key, response, latency)
+        return response
+
+    def fetch(self, fetch):
+        start = time.perf_counter()
+        response = fetch()
+        latency = time.perf_counter() - start
+
+        with self.lock:
+            self.upstream_requests += 1
+            self.upstream_seconds += latency
+
+        return response, latency
+
+    def store(self, membership_type, membership_id, key, response, latency):
+        # error responses from Bungie don't have a Response and aren't cached
+        if "Response" not in response:
+            return
+
+        entry = json.dumps(
+            {"fetchedAt": time.time(), "latency": latency, "response": response}
+        )
+        expires_in = self.ttl + self.stale_ttl
+        # the membership's keys are tracked in a set so invalidate doesn't have to scan for them
+        keys_key = f"{membership_key(membership_type, membership_id)}:keys"
+
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.set(key, entry, ex=expires_in)
+        pipeline.sadd(keys_key, key)
+        pipeline.expire(keys_key, expires_in)
+        pipeline.execute()
+
+    def refresh_in_background(self, membership_type, membership_id, key, fetch):
+        # only one worker refreshes an entry, the others keep serving it stale until it's replaced
+        if not self.redis.set(f"{key}:refreshing", 1, nx=True, ex=self.ttl or 1):
+            return
+
+        def refresh():
+            try:
+                response, latency = self.fetch(fetch)
+                self.store(membership_type, membership_id, key, response, latency)
+            except Exception:
+                # the stale entry keeps being served and the first request after the lock expires tries again
+                with self.lock:
+                    self.refresh_errors += 1
+                return
+
+            with self.lock:
+                self.refreshes += 1
+            self.redis.delete(f"{key}:refreshing")
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def invalidate(self, membership_type, membership_id):
+        keys_key = f"{membership_key(membership_type, membership_id)}:keys"
+        keys = self.redis.smembers(keys_key)
+
+        pipeline = self.redis.pipeline(transaction=True)
+        if keys:
+            pipeline.delete(*keys)
+        pipeline.delete(keys_key)
+        pipeline.execute()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "ttl": self.ttl,
+                "staleTtl": self.stale_ttl,
+                "hits": self.hits,
+                "staleHits": self.stale_hits,
+                "misses": self.misses,
+                "hitRate": (self.hits + self.stale_hits) / lookups if lookups else 0,
+                "refreshes": self.refreshes,
+                "refreshErrors": self.refresh_errors,
+                "upstreamRequests": self.upstream_requests,
+                "upstreamSeconds": self.upstream_seconds,
+                "upstreamSecondsSaved": self.saved_seconds,
+            }
+
+
+profile_cache = ProfileCache()
@@ -0,0 +1,26 @@
+import os
+
+import redis
+
+_redis_client = None
+_binary_redis_client = None
+
+
+def get_redis():
+    # one client (and connection pool) per worker process, redis-py resets the pool itself after a fork
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            os.environ.get("REDIS_URL"), decode_responses=True
+        )
+    return _redis_client
+
+
+def get_binary_redis():
+    # for values that aren't text, like serialized manifest definitions
+    global _binary_redis_client
+    if _binary_redis_client is None:
+        _binary_redis_client = redis.Redis.from_url(
+            os.environ.get("REDIS_URL"), decode_responses=False
+        )
+    return _binary_redis_client
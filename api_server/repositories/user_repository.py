@@ -3,13 +3,31 @@ import os
 from api_server.database import db
 from api_server.models import User
 from api_server.tables import users_table
-from sqlalchemy import insert, select
+from api_server.user_cache import user_cache
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+USER_COLUMNS = (
+    users_table.c.destiny_membership_type,
+    users_table.c.destiny_membership_id,
+    users_table.c.display_name,
+)
 
 
 class UserRepository:
+    def __init__(self, cache=user_cache):
+        self.cache = cache
+
     def get_user(self, destiny_membership_type, destiny_membership_id):
+        if destiny_membership_type is None or destiny_membership_id is None:
+            return None
+
+        cached = self.cache.get(destiny_membership_type, destiny_membership_id)
+        if cached is not None:
+            return User.from_db(cached)
+
         with db.begin() as connection:
-            statement = select(users_table).where(
+            statement = select(*USER_COLUMNS).where(
                 users_table.c.destiny_membership_type == destiny_membership_type,
                 users_table.c.destiny_membership_id == destiny_membership_id,
             )
@@ -18,21 +36,32 @@ class UserRepository:
 
             if result is None:
                 return None
-            else:
-                return User.from_db(result)
 
-    def create_user(self, user: User):
-        with db.begin() as connection:
-            statement = insert(users_table).returning(
+            row = dict(result._mapping)
+            self.cache.set(row)
+            return User.from_db(row)
+
+    def upsert_user(self, user: User):
+        # creates the user or updates their display name in one statement, so concurrent logins can't both
+        # try to insert, and writes the row through the cache
+        statement = insert(users_table).values(
+            destiny_membership_type=user.destiny_membership_type,
+            destiny_membership_id=user.destiny_membership_id,
+            display_name=user.display_name,
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[
                 users_table.c.destiny_membership_type,
                 users_table.c.destiny_membership_id,
-                users_table.c.display_name,
-            )
-            connection.execute(
-                statement,
-                {
-                    "destiny_membership_type": user.destiny_membership_type,
-                    "destiny_membership_id": user.destiny_membership_id,
-                    "display_name": user.display_name,
-                },
-            )
+            ],
+            set_={
+                "display_name": statement.excluded.display_name,
+                "updated_at": func.now(),
+            },
+        ).returning(*USER_COLUMNS)
+
+        with db.begin() as connection:
+            row = dict(connection.execute(statement).one()._mapping)
+
+        self.cache.set(row)
+        return User.from_db(row)
@@ -0,0 +1,105 @@
+from marshmallow import fields
+from marshmallow_enum import EnumField
+from marshmallow_oneofschema import OneOfSchema
+
+from api_server.models import (
+    ArmorPieceSchema,
+    CharacterSchema,
+    FullCharacterDataSchema,
+)
+
+# Compiles marshmallow schemas into plain functions that build the same dicts schema.dump does. The fields, their
+# camelCased keys and the nested schemas are read once from the bound schema and turned into the source of one
+# function per schema, so dumping is attribute reads and a dict literal instead of walking field objects.
+# Only the field types the models use are supported, anything else fails when the schema is compiled rather than
+# dumping something different from marshmallow.
+
+
+class SchemaCompiler:
+    def __init__(self):
+        self.functions = {}
+        self.sources = []
+        self.namespace = {}
+
+    def function_name(self, schema):
+        return f"dump_{type(schema).__name__}"
+
+    def compile(self, schema_class):
+        schema = schema_class()
+        name = self.function_name(schema)
+        if name not in self.functions:
+            self.add_schema(schema)
+            exec("\n\n".join(self.sources), self.namespace)
+            self.sources = []
+        return self.namespace[name]
+
+    def add_schema(self, schema):
+        name = self.function_name(schema)
+        if name in self.functions:
+            return name
+        self.functions[name] = None
+
+        if isinstance(schema, OneOfSchema):
+            source = self.one_of_source(name, schema)
+        else:
+            source = self.schema_source(name, schema)
+
+        self.functions[name] = source
+        self.sources.append(source)
+        return name
+
+    def schema_source(self, name, schema):
+        if schema.many or schema.only or schema.exclude:
+            raise TypeError(f"{type(schema).__name__} options can't be compiled")
+
+        items = []
+        for field_name, field in schema.dump_fields.items():
+            attribute = field.attribute or field_name
+            value = self.field_expression(field, f"obj.{attribute}", 0)
+            items.append(f"        {field.data_key!r}: {value},")
+
+        return "\n".join([f"def {name}(obj):", "    return {", *items, "    }"])
+
+    def one_of_source(self, name, schema):
+        # the dumped dict gets the name of the class it was dumped from under type_field, like OneOfSchema
+        lines = [f"def {name}(obj):", "    obj_type = obj.__class__.__name__"]
+        for type_name, type_schema in schema.type_schemas.items():
+            lines += [
+                f"    if obj_type == {type_name!r}:",
+                f"        result = {self.add_schema(type_schema())}(obj)",
+                f"        result[{schema.type_field!r}] = obj_type",
+                "        return result",
+            ]
+        lines.append(
+            f"    raise TypeError(f'{{obj_type}} isn\\'t a {type(schema).__name__} type')"
+        )
+
+        return "\n".join(lines)
+
+    def field_expression(self, field, value, depth):
+        # every field dumps None as None, like marshmallow
+        v = f"v{depth}"
+        if isinstance(field, fields.String):
+            converted = f"str({v})"
+        elif isinstance(field, fields.Integer) and not field.as_string:
+            converted = f"int({v})"
+        elif isinstance(field, EnumField) and field.dump_by == EnumField.VALUE:
+            converted = f"{v}.value"
+        elif isinstance(field, fields.Nested) and isinstance(field.nested, type):
+            if field.many or field.only or field.exclude:
+                raise TypeError(f"{field} options can't be compiled")
+            converted = f"{self.add_schema(field.nested())}({v})"
+        elif isinstance(field, fields.List):
+            item = self.field_expression(field.inner, f"i{depth}", depth + 1)
+            converted = f"[{item} for i{depth} in {v}]"
+        else:
+            raise TypeError(f"{type(field).__name__} fields can't be compiled")
+
+        return f"None if ({v} := {value}) is None else {converted}"
+
+
+compiler = SchemaCompiler()
+
+dump_character = compiler.compile(CharacterSchema)
+dump_full_character_data = compiler.compile(FullCharacterDataSchema)
+dump_armor_piece = compiler.compile(ArmorPieceSchema)
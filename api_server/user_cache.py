@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+
+from api_server.redis_client import get_redis
+
+# how long a user is kept, logins write through the cache so this only bounds how long an unused entry lives
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 7 * 24 * 60 * 60))
+
+
+def user_key(membership_type, membership_id):
+    return f"user:{membership_type}:{membership_id}"
+
+
+# The users table rows in redis, keyed by membership. UserRepository reads through it and writes every upsert
+# through it, so looking up the logged in user doesn't need the database.
+class UserCache:
+    def __init__(self, ttl=USER_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def redis(self):
+        return get_redis()
+
+    def get(self, membership_type, membership_id):
+        # returns the cached row as a dict, or None
+        if self.ttl <= 0:
+            return None
+
+        cached = self.redis.get(user_key(membership_type, membership_id))
+        with self.lock:
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return json.loads(cached) if cached is not None else None
+
+    def set(self, row):
+        if self.ttl <= 0:
+            return
+
+        self.redis.set(
+            user_key(row["destiny_membership_type"], row["destiny_membership_id"]),
+            json.dumps(row),
+            ex=self.ttl,
+        )
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0,
+            }
+
+
+user_cache = UserCache()
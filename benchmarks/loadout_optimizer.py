@@ -0,0 +1,150 @@
+# Checks the loadout search against trying every combination on small inventories, then times it on
+# inventories of 100 pieces per slot, where trying every combination would take 10^10 loadouts. The checks
+# with workers split the search between processes right away, so the processes are checked too.
+#
+#   python -m benchmarks.loadout_optimizer [--pieces N] [--workers N] [--time-budget S]
+#
+# pieces are synthetic with stats rolled like real armor, two groups of three stats that each add up to
+# around 30 points, and about one in ten is exotic
+import argparse
+import itertools
+import random
+import time
+
+from api_server.loadout_optimizer import (
+    LoadoutCandidate,
+    get_search_pool,
+    loadout_score,
+    optimize_loadout,
+)
+from api_server.models import ArmorPiece, ArmorStat, ArmorType, EnergyType
+
+STAT_GROUPS = [
+    [ArmorStat.Mobility, ArmorStat.Resilience, ArmorStat.Recovery],
+    [ArmorStat.Discipline, ArmorStat.Intellect, ArmorStat.Strength],
+]
+
+
+def synthetic_stats(r):
+    stats = {}
+    for group in STAT_GROUPS:
+        total = r.randint(26, 34)
+        first = r.randint(2, min(30, total - 4))
+        second = r.randint(2, min(30, total - first - 2))
+        for stat, value in zip(
+            group, r.sample([first, second, total - first - second], 3)
+        ):
+            stats[int(stat)] = value
+    return stats
+
+
+def synthetic_candidates(r, per_slot):
+    candidates = []
+    for armor_type in ArmorType:
+        for i in range(per_slot):
+            piece = ArmorPiece(
+                item_hash=r.getrandbits(32),
+                item_instance_id=f"{armor_type.value}-{i}",
+                item_type=armor_type,
+                bucket_hash=0,
+                name="Armor",
+                icon_path="",
+                energy_type=EnergyType.Arc,
+                energy_capacity=10,
+                energy_used=0,
+                mod_slots=[],
+            )
+            candidates.append(
+                LoadoutCandidate(
+                    piece=piece,
+                    stats=synthetic_stats(r),
+                    exotic=armor_type != ArmorType.ClassItem and r.random() < 0.1,
+                )
+            )
+    return candidates
+
+
+def every_combination_score(candidates, stat_hashes, minimums):
+    slots = [
+        [c for c in candidates if c.piece.item_type == armor_type]
+        for armor_type in ArmorType
+    ]
+    best = None
+    for loadout in itertools.product(*slots):
+        if sum(c.exotic for c in loadout) > 1:
+            continue
+        totals = [sum(c.stats[h] for c in loadout) for h in stat_hashes]
+        if any(sum(c.stats[h] for c in loadout) < m for h, m in minimums.items()):
+            continue
+        score = loadout_score(totals, len(stat_hashes))
+        if best is None or score > best:
+            best = score
+    return best
+
+
+def check_optimal(r, per_slot, workers):
+    for i in range(20):
+        candidates = synthetic_candidates(r, per_slot)
+        stat_hashes = [int(s) for s in r.sample(list(ArmorStat), r.randint(1, 4))]
+        minimums = {int(r.choice(list(ArmorStat))): r.randint(40, 90)}
+
+        expected = every_combination_score(candidates, stat_hashes, minimums)
+        loadout = optimize_loadout(
+            candidates,
+            stat_hashes,
+            minimums,
+            time_budget=60,
+            workers=workers if i % 2 else 0,
+            serial_time=0,
+        )
+        if loadout is None:
+            if expected is not None:
+                raise AssertionError("the search found no loadout but one exists")
+            continue
+
+        totals = [loadout.stats[str(h)] for h in stat_hashes]
+        if not loadout.complete or loadout_score(totals, len(stat_hashes)) != expected:
+            raise AssertionError(f"the search didn't find the best loadout {loadout}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pieces", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--time-budget", type=float, default=30)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # start the search processes up front, they're kept for the life of the worker
+        pool, _ = get_search_pool(args.workers)
+        list(pool.map(abs, range(args.workers)))
+
+    r = random.Random(0)
+    check_optimal(r, 7, args.workers)
+    print("best loadouts identical to trying every combination of 7 pieces per slot")
+
+    stat_hashes = [
+        [int(ArmorStat.Recovery), int(ArmorStat.Discipline)],
+        [int(ArmorStat.Resilience), int(ArmorStat.Recovery), int(ArmorStat.Intellect)],
+        [int(s) for s in ArmorStat],
+    ]
+    print(f"{args.pieces} pieces per slot, {args.pieces ** 5:.0e} loadouts")
+    print(
+        f"{'stats':<7}{'workers':>8}{'ms':>10}{'searched':>12}{'tiers':>7}{'complete':>10}"
+    )
+    for hashes in stat_hashes:
+        candidates = synthetic_candidates(r, args.pieces)
+        for workers in (0, args.workers):
+            start = time.perf_counter()
+            loadout = optimize_loadout(
+                candidates, hashes, time_budget=args.time_budget, workers=workers
+            )
+            elapsed = time.perf_counter() - start
+            print(
+                f"{len(hashes):<7}{workers:>8}{elapsed * 1e3:>10.1f}"
+                f"{loadout.searched:>12}{loadout.tiers:>7}{str(loadout.complete):>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Compares the bytes stored and the decode time per definition of the manifest serializers against the plain
+# json text the manifest used to be stored as.
+#
+#   python -m benchmarks.manifest_serialization [path to a world or table content file] [--table NAME]
+#
+# without a content file it runs on synthetic item definitions shaped like DestinyInventoryItemDefinition
+import argparse
+import json
+import random
+import time
+
+from api_server.manifest_projections import project_definition
+from api_server.manifest_serialization import (
+    JSONSerializer,
+    MsgpackSerializer,
+    ZstdSerializer,
+    msgpack,
+    zstandard,
+)
+from api_server.models import INVENTORY_ITEM_TABLE
+
+
+class PlainJSONSerializer:
+    # the format definitions were stored in before serializers existed
+    name = "json text (current)"
+
+    def dumps(self, value):
+        return json.dumps(value)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+def synthetic_definitions(count):
+    r = random.Random(0)
+    definitions = {}
+    for i in range(count):
+        definitions[str(i)] = {
+            "displayProperties": {
+                "name": f"Item {i}",
+                "description": "A description of the item " * r.randint(1, 4),
+                "icon": f"/common/destiny2_content/icons/{r.getrandbits(128):032x}.jpg",
+                "hasIcon": True,
+            },
+            "itemTypeDisplayName": r.choice(["Helmet", "Gauntlets", "Chest Armor"]),
+            "flavorText": "Flavor text " * r.randint(1, 10),
+            "investmentStats": [
+                {"statTypeHash": r.getrandbits(32), "value": r.randint(0, 10)}
+                for _ in range(r.randint(0, 6))
+            ],
+            "perks": [{"perkHash": r.getrandbits(32)} for _ in range(r.randint(0, 3))],
+            "sockets": {
+                "socketEntries": [
+                    {
+                        "socketTypeHash": r.getrandbits(32),
+                        "singleInitialItemHash": r.getrandbits(32),
+                        "reusablePlugSetHash": r.getrandbits(32),
+                        "reusablePlugItems": [],
+                        "preventInitializationOnVendorPurchase": False,
+                    }
+                    for _ in range(r.randint(4, 12))
+                ],
+                "socketCategories": [
+                    {"socketCategoryHash": r.getrandbits(32), "socketIndexes": [0, 1]}
+                ],
+            },
+            "hash": i,
+            "index": i,
+            "redacted": False,
+            "blacklisted": False,
+        }
+    return definitions
+
+
+def load_definitions(path, table_name):
+    with open(path) as f:
+        data = json.load(f)
+    return data.get(table_name, data)
+
+
+def measure(serializer, definitions):
+    encoded = [serializer.dumps(d) for d in definitions]
+
+    start = time.perf_counter()
+    for data in encoded:
+        serializer.loads(data)
+    elapsed = time.perf_counter() - start
+
+    return sum(len(e) for e in encoded), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--table", default=INVENTORY_ITEM_TABLE)
+    parser.add_argument("--count", type=int, default=5000)
+    parser.add_argument("--no-projection", action="store_true")
+    args = parser.parse_args()
+
+    if args.path:
+        definitions = load_definitions(args.path, args.table)
+    else:
+        definitions = synthetic_definitions(args.count)
+
+    definitions = list(definitions.values())
+    if not args.no_projection:
+        definitions = [project_definition(args.table, d) for d in definitions]
+
+    serializers = [PlainJSONSerializer(), JSONSerializer()]
+    if msgpack is not None:
+        serializers.append(MsgpackSerializer())
+    if zstandard is not None:
+        serializers += [ZstdSerializer(s) for s in list(serializers[1:])]
+
+    print(f"{len(definitions)} definitions")
+    print(f"{'serializer':<22}{'bytes/def':>12}{'decode us/def':>16}")
+    for serializer in serializers:
+        size, elapsed = measure(serializer, definitions)
+        print(
+            f"{serializer.name:<22}"
+            f"{size / len(definitions):>12.1f}"
+            f"{elapsed / len(definitions) * 1e6:>16.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# Checks that the vectorized mod fit engine gives the same answers as a plain loop over every armor piece and
+# mod set, then compares how long both take.
+#
+#   python -m benchmarks.mod_fit [--pieces N] [--mod-sets N]
+#
+# armor and mod sets are synthetic, pieces get 3 to 5 mod slots from a few socket types with some of them
+# already holding a mod, like a real vault
+import argparse
+import random
+import time
+
+from api_server.mod_fit import ArmorColumns, Mod, plug_energy_cost
+from api_server.models import (
+    ArmorPiece,
+    ArmorType,
+    EnergyType,
+    PlugResponse,
+    SocketResponse,
+)
+
+ENERGY_TYPES = [EnergyType.Arc, EnergyType.Solar, EnergyType.Void, EnergyType.Stasis]
+GENERAL_SOCKET_TYPE = 1
+SOCKET_TYPES = [GENERAL_SOCKET_TYPE, 2, 3, 4, 5, 6]
+
+
+def synthetic_socket(r, socket_type):
+    plug = None
+    if r.random() < 0.5:
+        plug = PlugResponse(
+            plug_hash=str(r.getrandbits(32)),
+            display_name="Mod",
+            icon_path="",
+            energy_type=r.choice([EnergyType.Any] + ENERGY_TYPES),
+            energy_cost=r.randint(1, 5),
+            perks=[],
+        )
+    return SocketResponse(
+        display_name="Socket",
+        socket_type=socket_type,
+        icon_path="",
+        plug_set_hash="",
+        initial_item_hash="",
+        current_plug=plug,
+    )
+
+
+def synthetic_piece(r, index):
+    socket_types = [GENERAL_SOCKET_TYPE, r.choice(SOCKET_TYPES[1:4])]
+    socket_types += r.sample(SOCKET_TYPES[3:], r.randint(1, 3))
+    mod_slots = [synthetic_socket(r, t) for t in socket_types]
+    energy_capacity = r.randint(1, 10)
+    energy_used = min(energy_capacity, sum(map(plug_energy_cost, mod_slots)))
+    return ArmorPiece(
+        item_hash=r.getrandbits(32),
+        item_instance_id=str(index),
+        item_type=r.choice(list(ArmorType)),
+        bucket_hash=0,
+        name="Armor",
+        icon_path="",
+        energy_type=r.choice(ENERGY_TYPES),
+        energy_capacity=energy_capacity,
+        energy_used=energy_used,
+        mod_slots=mod_slots,
+    )
+
+
+def synthetic_mod_set(r):
+    return [
+        Mod(
+            socket_type=r.choice(SOCKET_TYPES + [99]),
+            energy_type=r.choice([EnergyType.Any] * 3 + ENERGY_TYPES),
+            energy_cost=r.randint(1, 5),
+        )
+        for _ in range(r.randint(1, 3))
+    ]
+
+
+def loop_fits(piece, mods, replace):
+    # the same rules as ArmorColumns, one piece and mod set at a time
+    energy_types = {m.energy_type for m in mods if m.energy_type != EnergyType.Any}
+    if len(energy_types) > 1:
+        return False
+    if (
+        energy_types
+        and piece.energy_type != EnergyType.Any
+        and piece.energy_type not in energy_types
+    ):
+        return False
+
+    free_energy = piece.energy_capacity - piece.energy_used
+    for socket_type in {m.socket_type for m in mods}:
+        needed = sum(1 for m in mods if m.socket_type == socket_type)
+        slots = [
+            s
+            for s in piece.mod_slots
+            if int(s.socket_type) == socket_type and (replace or s.current_plug is None)
+        ]
+        if needed > len(slots):
+            return False
+        if replace:
+            costs = sorted(map(plug_energy_cost, slots), reverse=True)
+            free_energy += sum(costs[:needed])
+
+    return sum(m.energy_cost for m in mods) <= free_energy
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pieces", type=int, default=1000)
+    parser.add_argument("--mod-sets", type=int, default=200)
+    args = parser.parse_args()
+
+    r = random.Random(0)
+    pieces = [synthetic_piece(r, i) for i in range(args.pieces)]
+    mod_sets = [synthetic_mod_set(r) for _ in range(args.mod_sets)]
+
+    print(f"{args.pieces} armor pieces, {args.mod_sets} mod sets")
+    print(f"{'mods':<10}{'loop ms':>10}{'pack ms':>10}{'query ms':>10}{'speedup':>10}")
+    for replace in (False, True):
+        start = time.perf_counter()
+        expected = [[loop_fits(p, mods, replace) for p in pieces] for mods in mod_sets]
+        loop_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        armor = ArmorColumns(pieces)
+        pack_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fits = armor.fits(mod_sets, replace)
+        query_elapsed = time.perf_counter() - start
+
+        if fits.tolist() != expected:
+            raise AssertionError(f"fits differ from the loop with replace={replace}")
+
+        print(
+            f"{'replaced' if replace else 'kept':<10}"
+            f"{loop_elapsed * 1e3:>10.1f}"
+            f"{pack_elapsed * 1e3:>10.1f}"
+            f"{query_elapsed * 1e3:>10.1f}"
+            f"{loop_elapsed / (pack_elapsed + query_elapsed):>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Measures the memory held per parsed character by the model classes, against the same models as plain dataclasses
+# with a __dict__ per instance and a new icon url string per object, which is how they used to be built.
+#
+#   python -m benchmarks.model_memory [--count N]
+#
+# characters are synthetic but draw their icons and names from small pools, like real loadouts where the same mods
+# and perks show up on every armor piece
+import argparse
+import dataclasses
+import random
+import sys
+import tracemalloc
+
+from api_server.models import FullCharacterData
+from benchmarks.synthetic_models import SyntheticValues
+
+
+dict_models = {}
+
+
+def dict_model(model_class):
+    # the model as a dataclass without __slots__
+    if model_class not in dict_models:
+        dict_models[model_class] = dataclasses.make_dataclass(
+            model_class.__name__,
+            [(f.name, f.type) for f in dataclasses.fields(model_class)],
+        )
+    return dict_models[model_class]
+
+
+def rebuild(value, model_class, icon_path):
+    if dataclasses.is_dataclass(value):
+        return model_class(type(value))(
+            **{
+                f.name: rebuild(getattr(value, f.name), model_class, icon_path)
+                if not f.name.endswith("path")
+                else icon_path(getattr(value, f.name))
+                for f in dataclasses.fields(value)
+            }
+        )
+    if isinstance(value, list):
+        return [rebuild(v, model_class, icon_path) for v in value]
+    return value
+
+
+def measure(characters, model_class, icon_path):
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    built = [rebuild(c, model_class, icon_path) for c in characters]
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+
+    del built
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=500)
+    args = parser.parse_args()
+
+    r = random.Random(0)
+    pools = {
+        "icons": [
+            f"/common/destiny2_content/icons/{r.getrandbits(128):032x}.png"
+            for _ in range(200)
+        ],
+        "text": [f"Name {i}" for i in range(200)],
+    }
+    synthetic_value = SyntheticValues(r, list_lengths=(2, 6), int_bits=16, pools=pools)
+    characters = [synthetic_value(FullCharacterData) for _ in range(args.count)]
+
+    cases = [
+        (
+            "dataclasses with __dict__",
+            dict_model,
+            # the icon url used to be formatted again for every object
+            lambda path: f"https://bungie.net{path}",
+        ),
+        (
+            "slotted, interned urls",
+            lambda model_class: model_class,
+            lambda path: sys.intern(f"https://bungie.net{path}"),
+        ),
+    ]
+
+    print(f"{args.count} characters")
+    print(f"{'models':<28}{'bytes/character':>18}")
+    for name, model_class, icon_path in cases:
+        used = measure(characters, model_class, icon_path)
+        print(f"{name:<28}{used / args.count:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Checks that the compiled serializers dump exactly what the marshmallow schemas do, then compares how long
+# both take per character.
+#
+#   python -m benchmarks.serializers [--count N]
+#
+# characters are synthetic, every field is filled from the model's type hints, with None for optional values
+# and ints in some str fields so the conversions are covered too
+import argparse
+import json
+import random
+import time
+
+from api_server.models import (
+    Character,
+    CharacterSchema,
+    FullCharacterData,
+    FullCharacterDataSchema,
+)
+from api_server.serializers import dump_character, dump_full_character_data
+from benchmarks.synthetic_models import SyntheticValues
+
+
+def check_identical(name, marshmallow_dump, compiled_dump, values):
+    for value in values:
+        expected = json.dumps(marshmallow_dump(value))
+        actual = json.dumps(compiled_dump(value))
+        if expected != actual:
+            raise AssertionError(f"{name} output differs:\n{expected}\n{actual}")
+        if json.dumps(marshmallow_dump(value), sort_keys=True) != json.dumps(
+            compiled_dump(value), sort_keys=True
+        ):
+            raise AssertionError(f"{name} sorted output differs")
+
+
+def measure(dump, values):
+    start = time.perf_counter()
+    for value in values:
+        dump(value)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=2000)
+    args = parser.parse_args()
+
+    synthetic_value = SyntheticValues(random.Random(0), none_rate=0.2, int_str_rate=0.1)
+    characters = [synthetic_value(Character) for _ in range(args.count)]
+    full_characters = [synthetic_value(FullCharacterData) for _ in range(args.count)]
+
+    cases = [
+        (
+            "CharacterSchema",
+            lambda c: CharacterSchema().dump(c),
+            dump_character,
+            characters,
+        ),
+        (
+            "FullCharacterDataSchema",
+            lambda c: FullCharacterDataSchema().dump(c),
+            dump_full_character_data,
+            full_characters,
+        ),
+    ]
+
+    print(f"{args.count} objects per schema, outputs identical to marshmallow")
+    print(f"{'schema':<26}{'marshmallow us':>16}{'compiled us':>14}{'speedup':>10}")
+    for name, marshmallow_dump, compiled_dump, values in cases:
+        check_identical(name, marshmallow_dump, compiled_dump, values)
+
+        marshmallow_elapsed = measure(marshmallow_dump, values)
+        compiled_elapsed = measure(compiled_dump, values)
+        print(
+            f"{name:<26}"
+            f"{marshmallow_elapsed / len(values) * 1e6:>16.1f}"
+            f"{compiled_elapsed / len(values) * 1e6:>14.1f}"
+            f"{marshmallow_elapsed / compiled_elapsed:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
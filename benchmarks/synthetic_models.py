@@ -0,0 +1,59 @@
+# Synthetic model instances for the benchmarks, every field is filled from the model's type hints.
+#
+# none_rate is how often an optional field is None, int_str_rate how often a str field gets an int instead so the
+# conversions are covered. str fields take a new icon url each, unless pools are given: fields whose name ends in
+# path then draw from pools["icons"] and the rest from pools["text"], like real loadouts where the same mods and
+# perks show up on every armor piece
+import dataclasses
+import typing
+from enum import Enum
+
+
+class SyntheticValues:
+    def __init__(
+        self,
+        r,
+        none_rate=0.0,
+        int_str_rate=0.0,
+        list_lengths=(0, 6),
+        int_bits=32,
+        pools=None,
+    ):
+        self.r = r
+        self.none_rate = none_rate
+        self.int_str_rate = int_str_rate
+        self.list_lengths = list_lengths
+        self.int_bits = int_bits
+        self.pools = pools
+
+    def __call__(self, hint, name=""):
+        r = self.r
+        origin = typing.get_origin(hint)
+        if origin is typing.Union:
+            options = typing.get_args(hint)
+            if type(None) in options and r.random() < self.none_rate:
+                return None
+            return self(r.choice([o for o in options if o is not type(None)]), name)
+        if origin is list:
+            (item_hint,) = typing.get_args(hint)
+            return [self(item_hint, name) for _ in range(r.randint(*self.list_lengths))]
+        if dataclasses.is_dataclass(hint):
+            hints = typing.get_type_hints(hint)
+            return hint(
+                **{
+                    f.name: self(hints[f.name], f.name)
+                    for f in dataclasses.fields(hint)
+                }
+            )
+        if isinstance(hint, type) and issubclass(hint, Enum):
+            return r.choice(list(hint))
+        if hint is int:
+            return r.getrandbits(self.int_bits)
+        if hint is str:
+            if r.random() < self.int_str_rate:
+                return r.getrandbits(32)
+            if self.pools is not None:
+                pool = "icons" if name.endswith("path") else "text"
+                return r.choice(self.pools[pool])
+            return f"/common/destiny2_content/icons/{r.getrandbits(64):016x}.png"
+        raise TypeError(f"no synthetic value for {hint}")
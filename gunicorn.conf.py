@@ -0,0 +1,27 @@
+import gc
+import os
+
+# gunicorn reads this file from the working directory, so the server is started with just `gunicorn`
+
+wsgi_app = "api_server:create_app()"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+
+# create_app, and the manifest warmup in it, runs once in the master before the workers are forked, so every worker
+# starts with the warm manifest cache and shares its pages copy-on-write instead of loading the tables itself
+preload_app = os.environ.get("GUNICORN_PRELOAD_APP", "1") == "1"
+
+if preload_app and os.environ.get("MANIFEST_WARMUP") == "background":
+    # a warmup thread started in the master doesn't survive the fork, the workers would never become ready
+    os.environ["MANIFEST_WARMUP"] = "sync"
+
+
+def when_ready(server):
+    # runs in the master once the app is loaded, before any worker is forked. Frozen objects are left alone by the
+    # garbage collector, so collections in the workers don't write to (and copy) the pages of the warmed cache
+    if preload_app:
+        from api_server.database import db
+
+        # connections the master opened while loading the app would be inherited by every worker
+        db.dispose()
+        gc.freeze()
@@ -0,0 +1,85 @@
+import json
+import unittest
+
+from api_server.destiny_manifest import DestinyManifest, ManifestCache
+from api_server.manifest_serialization import JSONSerializer
+
+TABLE = "DestinyRaceDefinition"
+
+
+class MemoryManifestBackend:
+    # just enough of a manifest backend to store versions in memory and switch the active one
+    def __init__(self):
+        self.versions = {}
+        self.active_version = None
+
+    def store(self, version, table_name, definitions):
+        self.versions.setdefault(version, {})[table_name] = {
+            k: json.dumps(v).encode() for k, v in definitions.items()
+        }
+
+    def get_active_version(self):
+        return self.active_version
+
+    def load(self, version, table_name, keys):
+        table = self.versions.get(version, {}).get(table_name, {})
+        return [table.get(k) for k in keys]
+
+    def load_table(self, version, table_name):
+        return dict(self.versions.get(version, {}).get(table_name, {}))
+
+
+def race(name):
+    return {"genderedRaceNamesByGenderHash": {"1": name}}
+
+
+class VersionPinningTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryManifestBackend()
+        self.backend.store("v1", TABLE, {"1": race("v1 race"), "2": race("v1 other")})
+        self.backend.store("v2", TABLE, {"1": race("v2 race"), "2": race("v2 other")})
+        self.backend.active_version = "v1"
+        self.cache = ManifestCache()
+
+    def manifest(self):
+        return DestinyManifest(
+            cache=self.cache, serializer=JSONSerializer(), backend=self.backend
+        )
+
+    def activate_v2(self):
+        # another request reads the new version, which moves the shared cache over to it
+        self.backend.active_version = "v2"
+        newer = self.manifest()
+        self.assertEqual(newer.get_definition(TABLE, 1), race("v2 race"))
+        self.assertEqual(self.cache.version, "v2")
+
+    def test_definitions_stay_on_the_pinned_version(self):
+        pinned = self.manifest()
+        self.assertEqual(pinned.get_definition(TABLE, 1), race("v1 race"))
+
+        self.activate_v2()
+
+        self.assertEqual(pinned.version, "v1")
+        self.assertEqual(pinned.get_definition(TABLE, 1), race("v1 race"))
+        self.assertEqual(pinned.get_definition(TABLE, 2), race("v1 other"))
+
+    def test_tables_stay_on_the_pinned_version(self):
+        pinned = self.manifest()
+        self.assertEqual(pinned.get_table(TABLE)["1"], race("v1 race"))
+
+        self.activate_v2()
+        self.manifest().get_table(TABLE)
+
+        self.assertEqual(pinned.get_table(TABLE)["1"], race("v1 race"))
+
+    def test_pinned_reads_dont_replace_the_cached_version(self):
+        pinned = self.manifest()
+        self.activate_v2()
+
+        pinned.get_definition(TABLE, 2)
+
+        self.assertEqual(self.manifest().get_definition(TABLE, 2), race("v2 other"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import random
+import time
+import unittest
+
+from api_server.loadout_optimizer import LoadoutSearch, loadout_score, search_slots
+
+SCORED = 2
+
+
+class SharedScore:
+    # stands in for the manager Value the search processes share
+    def __init__(self, value):
+        self.value = value
+
+
+def synthetic_slots(r, per_slot):
+    # (stats, exotic) for five slots, stats are three stats of which the first SCORED are scored
+    return [
+        [
+            (tuple(r.randint(2, 30) for _ in range(3)), r.random() < 0.1)
+            for _ in range(per_slot)
+        ]
+        for _ in range(5)
+    ]
+
+
+def chosen_score(slots, chosen):
+    totals = [sum(s) for s in zip(*(slots[i][c][0] for i, c in enumerate(chosen)))]
+    return loadout_score(totals, SCORED)
+
+
+class SharedScoreTest(unittest.TestCase):
+    def setUp(self):
+        self.slots = synthetic_slots(random.Random(0), 6)
+        self.deadline = time.time() + 60
+
+    def test_a_higher_shared_score_keeps_the_own_best_score(self):
+        shared = SharedScore(-1)
+        search = LoadoutSearch(
+            self.slots, (0, 0, 0), SCORED, self.deadline, shared=shared
+        ).run()
+        best_score = search.best_score
+
+        # another process found a better loadout
+        shared.value = best_score + 100
+        search.share_best_score()
+
+        self.assertEqual(search.bound, best_score + 100)
+        self.assertEqual(search.best_score, best_score)
+        self.assertEqual(chosen_score(self.slots, search.best), search.best_score)
+
+    def test_search_slots_returns_the_score_of_its_loadout(self):
+        best = LoadoutSearch(self.slots, (0, 0, 0), SCORED, self.deadline).run()
+
+        score, chosen, _, _ = search_slots(
+            self.slots, (0, 0, 0), SCORED, self.deadline, SharedScore(best.best_score)
+        )
+        self.assertIsNone(chosen)
+
+        score, chosen, _, _ = search_slots(
+            self.slots, (0, 0, 0), SCORED, self.deadline, SharedScore(-1)
+        )
+        self.assertEqual(score, best.best_score)
+        self.assertEqual(chosen_score(self.slots, chosen), score)
+
+
+if __name__ == "__main__":
+    unittest.main()